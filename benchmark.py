@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""Benchmarks of coverage.py, info_v1.py and prepare_training.py on synthetic data.
+
+Generates an Events tree with the branches of coverage.ordered_vars and
+provider folders (config.pkl, data.npy, event_counts.json) laid out as
+info_v1.py expects them, then times every entry point end to end in a
+subprocess (wall time, CPU time and peak RSS of the child) and the stages of
+a coverage event loop in process. Results are printed and written as JSON.
+"""
+import ast
+import argparse
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+try:
+    import ROOT
+except ImportError:
+    ROOT = None
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# NanoAOD-like scalar branches, every other branch is an RVec<float>
+scalar_vars = {"GenMET_pt", "Pileup_nPU", "GenHT", "JetHT"}
+
+def value_kind(var):
+    """Rough distribution of a variable, so that every range gets entries."""
+    if var.endswith("nPU"):
+        return "pu"
+    if "DeltaR" in var or var.endswith("Dr") or var.endswith("_dr"):
+        return "dr"
+    return "pt_mass"
+
+# C++ generator of one value and numpy generator of n values, per kind
+root_generators = {
+    "pt_mass": "gRandom->Exp(150)",
+    "dr": "gRandom->Uniform(0, 1.2)",
+    "pu": "gRandom->Poisson(50)",
+}
+
+def numpy_values(kind, rng, n):
+    if kind == "pu":
+        return rng.poisson(50, n)
+    if kind == "dr":
+        return rng.uniform(0, 1.2, n)
+    return rng.exponential(150, n)
+
+def info_layout():
+    """ordered_vars and providers of info_v1.py, read from its source (the
+    script runs on import)."""
+    with open(os.path.join(here, "info_v1.py"), "r") as fh:
+        tree = ast.parse(fh.read())
+    found = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            if node.targets[0].id in ("ordered_vars", "providers"):
+                found[node.targets[0].id] = ast.literal_eval(node.value)
+    return found["ordered_vars"], found["providers"]
+
+# ------------------------------------------
+# Synthetic inputs
+# ------------------------------------------
+
+def make_events_file(path, n_events, varnames, seed=1, multiplicity=4):
+    """Write an Events tree of n_events with one branch per variable."""
+    ROOT.gRandom.SetSeed(seed)
+    df = ROOT.RDataFrame(n_events)
+    branches = list(dict.fromkeys(varnames))
+    for var in branches:
+        gen = root_generators[value_kind(var)]
+        if var in scalar_vars:
+            df = df.Define(var, f"return float({gen});")
+        else:
+            df = df.Define(var, f"ROOT::RVecF v(gRandom->Poisson({multiplicity})); "
+                                f"for (auto &x : v) x = {gen}; return v;")
+    df.Snapshot("Events", path, branches)
+    return path
+
+def make_provider_folders(parent, n_rows, n_events, seed=1, ntargets=2):
+    """Provider folders of info_v1.py with n_rows rows of float32 data each."""
+    ordered, providers = info_layout()
+    rng = np.random.default_rng(seed)
+    features = {}
+    for var, provider in zip(ordered, providers):
+        features.setdefault(provider, [])
+        if var not in features[provider]:
+            features[provider].append(var)
+    for provider, cond in features.items():
+        folder = os.path.join(parent, provider)
+        os.makedirs(folder, exist_ok=True)
+        target = [f"target_{i}" for i in range(ntargets)]
+        config = {"conditioning_features": cond, "target_features": target}
+        with open(os.path.join(folder, "config.pkl"), "wb") as fh:
+            pickle.dump(config, fh)
+        data = np.empty((n_rows, len(cond) + ntargets), dtype=np.float32)
+        for ic, var in enumerate(cond):
+            data[:, ic] = numpy_values(value_kind(var), rng, n_rows)
+        data[:, len(cond):] = rng.normal(size=(n_rows, ntargets))
+        np.save(os.path.join(folder, "data.npy"), data)
+        with open(os.path.join(folder, "event_counts.json"), "w") as fh:
+            json.dump({"synthetic.root": n_events}, fh)
+    return sorted(features)
+
+def write_provider_summaries(parent):
+    """summary.json of every provider folder, as prepare_training writes it.
+    Returns False if prepare_training cannot be imported here."""
+    try:
+        import prepare_training
+    except ImportError:
+        return False
+    for provider in os.listdir(parent):
+        folder = os.path.join(parent, provider)
+        with open(os.path.join(folder, "config.pkl"), "rb") as fh:
+            config = pickle.load(fh)
+        prepare_training.write_summary(folder, config["conditioning_features"] + config["target_features"])
+    return True
+
+# ------------------------------------------
+# Measurements
+# ------------------------------------------
+
+def run_timed(name, cmd, cwd, log_dir, events=0, rows=0):
+    """Run cmd and measure the child alone: wall, user+system CPU and peak RSS."""
+    log = os.path.join(log_dir, name.replace(" ", "_") + ".log")
+    start = time.perf_counter()
+    with open(log, "w") as fh:
+        proc = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL, stdout=fh, stderr=subprocess.STDOUT)
+        _pid, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    code = os.waitstatus_to_exitcode(status)
+    return result(name, wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024, events, rows,
+                  "ok" if code == 0 else f"failed ({code}), see {log}")
+
+def result(name, wall, cpu, rss_mb, events=0, rows=0, status="ok"):
+    return {
+        "name": name, "status": status, "wall_s": wall, "cpu_s": cpu, "peak_rss_mb": rss_mb,
+        "events": events, "rows": rows,
+        "events_per_s": events / wall if events and wall > 0 else None,
+        "rows_per_s": rows / wall if rows and wall > 0 else None,
+    }
+
+def skipped(name, reason):
+    return {"name": name, "status": f"skipped: {reason}"}
+
+def coverage_stages(filename, engine, n_events):
+    """Stages of one coverage event loop, timed in process: dataset, column
+    types, booking (jitting) and the event loop itself."""
+    import coverage
+    stages = []
+    clock = time.perf_counter()
+    cpu = time.process_time()
+
+    def lap(stage):
+        nonlocal clock, cpu
+        now, now_cpu = time.perf_counter(), time.process_time()
+        stages.append(result(f"coverage {engine}: {stage}", now - clock, now_cpu - cpu, None,
+                             n_events if stage == "event loop" else 0))
+        clock, cpu = time.perf_counter(), time.process_time()
+
+    df = ROOT.RDataFrame("Events", filename)
+    lap("dataset")
+    types = coverage.column_types(df, [var for var, _b in coverage.unique_keys])
+    lap("column types")
+    if engine == "kernel":
+        handle, present = coverage.book_kernel(df, coverage.unique_keys, types)
+        handles = [handle] if handle is not None else []
+    else:
+        handles = []
+        for i, (var, b) in enumerate(coverage.unique_keys):
+            hs = coverage.book_ranges(df, var, coverage.binnings[b], f"bench{i}", engine, types)
+            handles += hs or []
+    lap("booking")
+    if handles:
+        ROOT.RDF.RunGraphs(handles)
+    lap("event loop")
+    return stages
+
+def print_results(results):
+    print(f"\n{'benchmark':48} {'wall [s]':>9} {'cpu [s]':>9} {'RSS [MB]':>9} {'events/s':>11} {'rows/s':>11}")
+    for r in results:
+        if r["status"] != "ok":
+            print(f"{r['name']:48} {r['status']}")
+            continue
+        fmt = lambda v, f: format(v, f) if v is not None else "-"
+        print(f"{r['name']:48} {r['wall_s']:9.3f} {r['cpu_s']:9.3f} {fmt(r['peak_rss_mb'], '9.1f'):>9} "
+              f"{fmt(r['events_per_s'], '11.0f'):>11} {fmt(r['rows_per_s'], '11.0f'):>11}")
+
+# ------------------------------------------
+# Main
+# ------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks on synthetic data")
+    parser.add_argument("--events", type=int, help="events of the synthetic Events tree", default=100000, required=False)
+    parser.add_argument("--rows", type=int, help="rows of every synthetic provider data.npy", default=1000000, required=False)
+    parser.add_argument("--samples", type=int, help="synthetic samples (parent folders) for info_v1", default=2, required=False)
+    parser.add_argument(
+        "--only", type=str, nargs="+", choices=["coverage", "info", "extraction"],
+        help="entry points to benchmark", default=["coverage", "info", "extraction"], required=False,
+    )
+    parser.add_argument(
+        "--engines", type=str, nargs="+", choices=["kernel", "histo", "sum"],
+        help="coverage engines to benchmark", default=["kernel", "histo"], required=False,
+    )
+    parser.add_argument("--workers", type=int, help="--workers passed to the entry points", default=1, required=False)
+    parser.add_argument(
+        "--extraction_config", type=str,
+        help="config expression of prepare_training.py; the extraction is skipped without it",
+        default=None, required=False,
+    )
+    parser.add_argument(
+        "--extraction_input", type=str, help="input of prepare_training.py (default: the synthetic Events tree)",
+        default=None, required=False,
+    )
+    parser.add_argument("--nanoversion", type=str, help="config version of prepare_training.py", default="nanoV9", required=False)
+    parser.add_argument("--workdir", type=str, help="directory of the synthetic data (default: a temporary one)", default=None, required=False)
+    parser.add_argument(
+        "--keep",
+        action=argparse.BooleanOptionalAction,
+        help="keep the synthetic data and logs",
+        required=False,
+        default=False,
+    )
+    parser.add_argument("--output", type=str, help="JSON file of the results", default="benchmark.json", required=False)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="flashsim_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    log_dir = os.path.join(workdir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    results = []
+
+    events_file = None
+    if ROOT is not None and ("coverage" in args.only or ("extraction" in args.only and not args.extraction_input)):
+        import coverage
+        events_file = os.path.join(workdir, "events.root")
+        start = time.perf_counter()
+        make_events_file(events_file, args.events, coverage.ordered_vars)
+        print(f"Generated {args.events} events in {time.perf_counter() - start:.1f} s")
+
+    if "coverage" in args.only:
+        if ROOT is None:
+            results.append(skipped("coverage", "ROOT is not available"))
+        else:
+            for engine in args.engines:
+                results.append(run_timed(
+                    f"coverage {engine}", [sys.executable, os.path.join(here, "coverage.py"), events_file,
+                                           "--engine", engine, "--no-cache"],
+                    workdir, log_dir, events=args.events))
+            for engine in args.engines:
+                results += coverage_stages(events_file, engine, args.events)
+
+    if "info" in args.only:
+        parents = []
+        start = time.perf_counter()
+        for i in range(args.samples):
+            parent = os.path.join(workdir, f"sample_{i}")
+            make_provider_folders(parent, args.rows, args.events, seed=i)
+            parents.append(parent)
+        print(f"Generated {args.samples} samples of {args.rows} rows per provider in {time.perf_counter() - start:.1f} s")
+        nproviders = len(os.listdir(parents[0]))
+        info_cmd = [sys.executable, os.path.join(here, "info_v1.py")] + parents + ["--workers", str(args.workers)]
+        rows = args.samples * nproviders * args.rows
+        results.append(run_timed("info_v1 raw arrays", info_cmd, workdir, log_dir, rows=rows))
+        if all(write_provider_summaries(parent) for parent in parents):
+            results.append(run_timed("info_v1 summary", info_cmd, workdir, log_dir, rows=rows))
+        else:
+            results.append(skipped("info_v1 summary", "prepare_training cannot be imported (flashsim)"))
+
+    if "extraction" in args.only:
+        extraction_input = args.extraction_input or events_file
+        if importlib.util.find_spec("flashsim") is None:
+            results.append(skipped("prepare_training", "flashsim is not installed"))
+        elif args.extraction_config is None:
+            results.append(skipped("prepare_training", "no --extraction_config"))
+        elif extraction_input is None:
+            results.append(skipped("prepare_training", "no input (ROOT is not available)"))
+        else:
+            folder = os.path.join(workdir, "extraction")
+            r = run_timed("prepare_training", [
+                sys.executable, os.path.join(here, "prepare_training.py"), folder, args.extraction_config,
+                extraction_input, "--nanoversion", args.nanoversion, "--workers", str(args.workers),
+                "--skip_plots"], workdir, log_dir)
+            if r["status"] == "ok":
+                counts = os.path.join(folder, "event_counts.json")
+                data = os.path.join(folder, "data.npy")
+                if os.path.exists(counts):
+                    with open(counts, "r") as fh:
+                        r["events"] = sum(int(n) for n in json.load(fh).values())
+                if os.path.exists(data):
+                    r["rows"] = int(np.load(data, mmap_mode="r").shape[0])
+                r = result(r["name"], r["wall_s"], r["cpu_s"], r["peak_rss_mb"], r["events"], r["rows"])
+            results.append(r)
+            # per-stage numbers from the profile prepare_training writes
+            profile_path = os.path.join(folder, "profile.json")
+            if os.path.exists(profile_path):
+                with open(profile_path, "r") as fh:
+                    for stage, rec in json.load(fh)["stages"].items():
+                        results.append(result(f"prepare_training: {stage}", rec["wall_s"], rec["cpu_s"],
+                                              rec.get("peak_rss_mb", rec.get("peak_rss_so_far_mb")),
+                                              rec["events"], rec.get("rows", 0)))
+
+    print_results(results)
+    with open(args.output, "w") as fh:
+        json.dump({"events": args.events, "rows": args.rows, "samples": args.samples, "results": results}, fh, indent=2)
+    print(f"\nWrote results to {args.output}")
+
+    if args.keep:
+        print(f"Synthetic data kept in {workdir}")
+    elif not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -1,45 +1,49 @@
 #!/usr/bin/env python3
 import ROOT
 import sys
-
-ROOT.ROOT.EnableImplicitMT()
-
-# Provide filename by pasting the full path (no quotes) when prompted,
-# or pass it as the first command-line argument.
-if len(sys.argv) > 1:
-    filename = sys.argv[1].strip()
-else:
-    filename = input("Paste full filename (no quotes), then press Enter: ").strip()
-
-if not filename:
-    raise SystemExit("No filename provided. Exiting.")
-
-df = ROOT.RDataFrame("Events", filename)
-
-# Total events
-n_events = df.Count().GetValue()
-scale = 1e6 / n_events
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import argparse
+import bisect
+import math
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import rootio
 
 # ------------------------------------------
 # Helpers
 # ------------------------------------------
 
-def branch_exists(df, branch):
-    return branch in df.GetColumnNames()
+def column_types(df, varnames):
+    """Type of every requested column present in the dataset, read once per file."""
+    present = set(str(c) for c in df.GetColumnNames())
+    return {v: str(df.GetColumnType(v)) for v in set(varnames) if v in present}
+
+def is_vector(coltype):
+    return "RVec" in coltype or "vector" in coltype
 
-def count_vector(df, varname, condition):
-    if not branch_exists(df, varname):
+def count_expression(coltype, condition):
+    # per-event number of matching elements for RVec columns, 0/1 for scalars
+    return f"Sum({condition})" if is_vector(coltype) else condition
+
+def count_vector(df, varname, condition, types):
+    if varname not in types:
         return None
-    # Try vector-style per-event Sum (works if x is an RVec)
-    try:
-        return df.Define("x", varname) \
-                 .Define("cnt", f"Sum({condition})") \
-                 .Sum("cnt").GetValue()
-    except Exception:
-        # Fallback: define a per-event boolean/int and sum over events (works for scalars)
-        return df.Define("x", varname) \
-                 .Define("cnt", condition) \
-                 .Sum("cnt").GetValue()
+    return df.Define("x", varname) \
+             .Define("cnt", count_expression(types[varname], condition)) \
+             .Sum("cnt").GetValue()
+
+def book_vector(df, varname, condition, types):
+    """Lazy version of count_vector: returns the booked Sum, or None if the branch is missing."""
+    if varname not in types:
+        return None
+    return df.Define("x", varname) \
+             .Define("cnt", count_expression(types[varname], condition)) \
+             .Sum("cnt")
 
 # ------------------------------------------
 # EXACT required variable order
@@ -209,76 +213,628 @@ pu_vars = {
 }
 
 # ------------------------------------------
-# Spreadsheet output list
+# Binnings
 # ------------------------------------------
-spreadsheet_output = []
 
-# ------------------------------------------
-# PRINT RANGES + COMPUTE RESULTS
-# ------------------------------------------
+inf = math.inf
 
-print("\nVariables and ranges:\n")
-print("====================================\n")
-
-for var in ordered_vars:
-
-    print(f"=== {var} ===")
+# (labels, edges, right). With right=True the ranges are (a, b] and the first
+# one is closed, [a, b]; with right=False they are [a, b) and the last one is
+# closed. Open-ended ranges use -inf/inf as edge.
+binnings = {
+    "pt_mass": (("0-100", "101-1000", ">1000"), (0, 100, 1000, inf), True),
+    "dr":      (("<0.4", "≥0.4"), (-inf, 0.4, inf), False),
+    "pu":      (("0-40", "41-60", ">60"), (0, 40, 60, inf), True),
+}
 
+def binning_for(var):
     # PT / MASS VARIABLES
     if var in pt_mass_vars:
-        ranges = [
-            ("0-100",  "x >= 0 && x <= 100"),
-            ("101-1000", "x > 100 && x <= 1000"),
-            (">1000", "x > 1000")
-        ]
-        for label, cond in ranges:
-            c = count_vector(df, var, cond)
-            if c is None:
-                print(f" {label:12}: Not found in the dataset")
-                spreadsheet_output.append("Not found in the dataset")
-            else:
-                val = c * scale
-                print(f" {label:12}: {val:.2f}")
-                spreadsheet_output.append(f"{val:.2f}")
-
+        return "pt_mass"
     # ΔR VARIABLES
     elif var in dr_vars:
-        ranges = [
-            ("<0.4", "x < 0.4"),
-            ("≥0.4", "x >= 0.4")
-        ]
-        for label, cond in ranges:
-            c = count_vector(df, var, cond)
-            if c is None:
-                print(f" {label:12}: Not found in the dataset")
-                spreadsheet_output.append("Not found in the dataset")
-            else:
-                val = c * scale
-                print(f" {label:12}: {val:.2f}")
-                spreadsheet_output.append(f"{val:.2f}")
-
+        return "dr"
     # PU VARIABLES
     elif var in pu_vars:
-        ranges = [
-            ("0-40",   "x >= 0 && x <= 40"),
-            ("41-60",  "x > 40 && x <= 60"),
-            (">60",    "x > 60")
-        ]
-        for label, cond in ranges:
-            c = count_vector(df, var, cond)
-            if c is None:
-                print(f" {label:12}: Not found in the dataset")
-                spreadsheet_output.append("Not found in the dataset")
-            else:
-                val = c * scale
-                print(f" {label:12}: {val:.2f}")
-                spreadsheet_output.append(f"{val:.2f}")
-
-    print()  # Blank line between variables
+        return "pu"
+    return None
+
+def range_conditions(binning):
+    """C++ condition on x for every range of a binning, e.g. "x > 100 && x <= 1000"."""
+    labels, edges, right = binning
+    conds = []
+    for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+        lo_closed = not right or i == 0
+        hi_closed = right or i == len(labels) - 1
+        parts = []
+        if lo != -inf:
+            parts.append(f"x {'>=' if lo_closed else '>'} {lo:g}")
+        if hi != inf:
+            parts.append(f"x {'<=' if hi_closed else '<'} {hi:g}")
+        conds.append(" && ".join(parts))
+    return conds
+
+def histo_axis(binning):
+    """Finite TH1 bin edges of a binning and the (first, last) TH1 bins of each range.
+
+    Right-closed binnings are filled with -x, which turns every (a, b] range
+    into the [-b, -a) bin that TH1 provides.
+    """
+    labels, edges, right = binning
+    if right:
+        edges = [-e for e in reversed(edges)]
+    axis = [float(e) for e in edges if math.isfinite(e)]
+    if math.isfinite(edges[-1]):
+        # the last range is closed on both sides
+        axis[-1] = math.nextafter(axis[-1], inf)
+    if len(axis) < 2:
+        axis.append(axis[-1] + 1)
+    spans = []
+    for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+        first = 0 if lo == -inf else bisect.bisect_right(axis, lo)
+        if hi == inf:
+            last = len(axis)  # overflow
+        elif i == len(labels) - 1:
+            last = bisect.bisect_right(axis, hi)
+        else:
+            last = bisect.bisect_right(axis, hi) - 1
+        spans.append((first, last))
+    if right:
+        spans.reverse()
+    return axis, spans
+
+def book_histo(df, var, binning, tag, types):
+    """Book one Histo1D holding every range of var; RVec columns are flattened by Histo1D.
+
+    NaNs are dropped before filling: TH1 would put them in the overflow bin,
+    which open-ended ranges count (the conditions never match NaN).
+    """
+    if var not in types:
+        return None
+    axis, _spans = histo_axis(binning)
+    model = ROOT.RDF.TH1DModel(f"h_{tag}", var, len(axis) - 1, array("d", axis))
+    x = f"-1.0 * {var}" if binning[2] else var
+    col = f"fill_{tag}"
+    if is_vector(types[var]):
+        # (x == x is false only for NaN)
+        return df.Define(col, f"auto x = {x}; return x[x == x];").Histo1D(model, col)
+    return df.Filter(f"{var} == {var}", f"not NaN {tag}").Define(col, x).Histo1D(model, col)
+
+def histo_counts(h, binning):
+    _axis, spans = histo_axis(binning)
+    return [int(round(h.Integral(first, last))) for first, last in spans]
+
+def book_ranges(df, var, binning, tag, engine, types):
+    """Book the counts of every range of var; returns the list of handles, or None."""
+    if engine == "histo":
+        h = book_histo(df, var, binning, tag, types)
+        return None if h is None else [h]
+    handles = [book_vector(df, var, cond, types) for cond in range_conditions(binning)]
+    return None if None in handles else handles
+
+def read_ranges(handles, binning, engine):
+    if engine == "histo":
+        return histo_counts(handles[0].GetValue(), binning)
+    return [h.GetValue() for h in handles]
 
 # ------------------------------------------
-# Final spreadsheet output
+# Compiled counting kernel
 # ------------------------------------------
-print("\nResults (to be pasted on the spreadsheet):\n")
-for line in spreadsheet_output:
-    print(line)
+
+# One RDF action reading every requested column per event and incrementing
+# the counter of the range each value falls in, in per-slot accumulators.
+# Declared once per process; only the small booking function below is
+# compiled per column-type signature.
+kernel_code = r"""
+#include <ROOT/RDataFrame.hxx>
+#include <ROOT/RVec.hxx>
+#include <algorithm>
+#include <memory>
+#include <string>
+#include <vector>
+
+namespace coverage {
+
+// Range of edges containing x, or -1. right: (a, b] with the first range
+// closed, otherwise [a, b) with the last range closed. NaN is in no range.
+inline int FindRange(const std::vector<double> &edges, bool right, double x)
+{
+   const int n = edges.size();
+   int r;
+   if (right) {
+      r = std::lower_bound(edges.begin(), edges.end(), x) - edges.begin() - 1;
+      if (x == edges.front())
+         r = 0;
+   } else {
+      r = std::upper_bound(edges.begin(), edges.end(), x) - edges.begin() - 1;
+      if (x == edges.back())
+         r = n - 2;
+   }
+   return (r >= 0 && r < n - 1) ? r : -1;
+}
+
+template <typename... ColumnTypes>
+class CountAction : public ROOT::Detail::RDF::RActionImpl<CountAction<ColumnTypes...>> {
+public:
+   using Result_t = std::vector<ULong64_t>;
+
+private:
+   std::vector<std::vector<double>> fEdges;
+   std::vector<int> fRight;
+   std::vector<std::size_t> fOffsets;
+   std::vector<std::vector<ULong64_t>> fPerSlot;
+   std::shared_ptr<Result_t> fResult;
+
+   void Add(unsigned int slot, std::size_t i, double x)
+   {
+      const int r = FindRange(fEdges[i], fRight[i], x);
+      if (r >= 0)
+         ++fPerSlot[slot][fOffsets[i] + r];
+   }
+   template <typename T>
+   void Fill(unsigned int slot, std::size_t i, const T &x)
+   {
+      Add(slot, i, x);
+   }
+   template <typename T>
+   void Fill(unsigned int slot, std::size_t i, const ROOT::RVec<T> &v)
+   {
+      for (const auto &x : v)
+         Add(slot, i, x);
+   }
+
+public:
+   CountAction(const std::vector<std::vector<double>> &edges, const std::vector<int> &right, unsigned int nSlots)
+      : fEdges(edges), fRight(right)
+   {
+      std::size_t n = 0;
+      for (const auto &e : fEdges) {
+         fOffsets.push_back(n);
+         n += e.size() - 1;
+      }
+      fPerSlot.assign(nSlots, std::vector<ULong64_t>(n, 0));
+      fResult = std::make_shared<Result_t>(n, 0);
+   }
+   CountAction(CountAction &&) = default;
+   CountAction(const CountAction &) = delete;
+
+   std::shared_ptr<Result_t> GetResultPtr() const { return fResult; }
+   void Initialize() {}
+   void InitTask(TTreeReader *, unsigned int) {}
+   void Exec(unsigned int slot, const ColumnTypes &...values)
+   {
+      std::size_t i = 0;
+      (Fill(slot, i++, values), ...);
+   }
+   void Finalize()
+   {
+      for (const auto &counts : fPerSlot)
+         for (std::size_t j = 0; j < counts.size(); ++j)
+            (*fResult)[j] += counts[j];
+   }
+   std::string GetActionName() { return "CoverageCount"; }
+};
+
+} // namespace coverage
+"""
+
+_kernel_declared = False
+_kernel_bookers = {}
+
+def kernel_booker(coltypes):
+    """Name of the C++ function booking a CountAction on columns of these types."""
+    global _kernel_declared
+    if not _kernel_declared:
+        ROOT.gInterpreter.Declare(kernel_code)
+        _kernel_declared = True
+    coltypes = tuple(coltypes)
+    if coltypes not in _kernel_bookers:
+        name = "coverage_book_" + hashlib.sha1("|".join(coltypes).encode()).hexdigest()[:16]
+        targs = ", ".join(coltypes)
+        ROOT.gInterpreter.Declare(f"""
+ROOT::RDF::RResultPtr<std::vector<ULong64_t>> {name}(ROOT::RDF::RNode df,
+   const std::vector<std::vector<double>> &edges, const std::vector<int> &right,
+   const std::vector<std::string> &columns)
+{{
+   return df.Book<{targs}>(coverage::CountAction<{targs}>(edges, right, df.GetNSlots()), columns);
+}}
+""")
+        _kernel_bookers[coltypes] = name
+    return _kernel_bookers[coltypes]
+
+def book_kernel(df, keys, types):
+    """Book the counts of every key whose variable is in the dataset as a
+    single CountAction; returns (handle, booked keys), handle None if no key is."""
+    present = [key for key in keys if key[0] in types]
+    if not present:
+        return None, []
+    edges = ROOT.std.vector["std::vector<double>"]()
+    right = ROOT.std.vector["int"]()
+    columns = ROOT.std.vector["std::string"]()
+    for var, b in present:
+        _labels, e, r = binnings[b]
+        edges.push_back(ROOT.std.vector["double"]([float(x) for x in e]))
+        right.push_back(int(r))
+        columns.push_back(var)
+    booker = getattr(ROOT, kernel_booker(types[var] for var, _b in present))
+    return booker(ROOT.RDF.AsRNode(df), edges, right, columns), present
+
+def read_kernel(handle, present):
+    """Split the flat counter vector of a CountAction into {key: [count, ...]}."""
+    flat = [int(c) for c in handle.GetValue()] if handle is not None else []
+    counts, offset = {}, 0
+    for key in present:
+        n = len(binnings[key[1]][0])
+        counts[key] = flat[offset:offset + n]
+        offset += n
+    return counts
+
+# ------------------------------------------
+# COMPUTE RESULTS
+# ------------------------------------------
+
+def compute_counts(df, keys, engine="kernel", single_pass=True):
+    """Range counts for every unique (variable, binning) key.
+
+    Returns {key: [count, ...]}, with None for variables missing from the dataset.
+    """
+    counts = {}
+    # RVec or scalar expression is decided upfront from the column types
+    types = column_types(df, [var for var, _b in keys])
+    if engine == "kernel":
+        # one compiled action for all keys, always a single pass
+        handle, present = book_kernel(df, keys, types)
+        if handle is not None:
+            ROOT.RDF.RunGraphs([handle])
+        counts = read_kernel(handle, present)
+        return {key: counts.get(key) for key in keys}
+    if single_pass:
+        booked = {key: book_ranges(df, key[0], binnings[key[1]], i, engine, types) for i, key in enumerate(keys)}
+        handles = [h for hs in booked.values() if hs is not None for h in hs]
+        if handles:
+            # Trigger everything together: the Events tree is read once
+            ROOT.RDF.RunGraphs(handles)
+        for key, hs in booked.items():
+            counts[key] = None if hs is None else read_ranges(hs, binnings[key[1]], engine)
+        return counts
+    for i, (var, b) in enumerate(keys):
+        if engine == "sum":
+            c = [count_vector(df, var, cond, types) for cond in range_conditions(binnings[b])]
+            counts[(var, b)] = None if None in c else c
+        else:
+            hs = book_ranges(df, var, binnings[b], i, engine, types)
+            counts[(var, b)] = None if hs is None else read_ranges(hs, binnings[b], engine)
+    return counts
+
+# Several variables appear more than once in ordered_vars: compute each
+# (variable, binning) pair once and rebuild the report from the cache.
+unique_keys = list(dict.fromkeys(
+    (var, binning_for(var)) for var in ordered_vars if binning_for(var) is not None
+))
+
+# ------------------------------------------
+# Result cache
+# ------------------------------------------
+
+def file_identity(filename):
+    """Path, size and mtime of a file; remote (xrootd) files use size and TFile UUID."""
+    try:
+        st = os.stat(filename)
+        return {"path": os.path.abspath(filename), "size": st.st_size, "mtime": st.st_mtime_ns}
+    except OSError:
+        f = ROOT.TFile.Open(filename)
+        if not f or f.IsZombie():
+            return None
+        identity = {"path": filename, "size": f.GetSize(), "uuid": f.GetUUID().AsString()}
+        f.Close()
+        return identity
+
+def cache_key(key):
+    """String key of a (variable, binning) pair, including the binning definition."""
+    var, b = key
+    return f"{var}|{json.dumps(binnings[b])}"
+
+def load_cache(cache_dir, identity):
+    path = os.path.join(cache_dir, hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest() + ".json")
+    if os.path.isfile(path):
+        try:
+            with open(path, "r") as fh:
+                entry = json.load(fh)
+            if entry.get("identity") == identity:
+                return path, entry
+        except Exception:
+            pass
+    return path, {"identity": identity, "n_events": None, "counts": {}}
+
+def save_cache(path, entry):
+    # write to a temporary file and rename, so that concurrent workers never see half a file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as fh:
+        json.dump(entry, fh)
+    os.replace(tmp, path)
+
+def tree_entries(filename, io_options=None):
+    """Number of Events entries as stored in the file header; no event is read.
+
+    Also sizes the TTreeCache of the RDataFrame reading the file, from io_options.
+    """
+    f = ROOT.TFile.Open(filename)
+    if not f or f.IsZombie():
+        return None
+    tree = f.Get("Events")
+    if tree:
+        rootio.set_rdf_cache_size(tree, io_options)
+    n = int(tree.GetEntries()) if tree else None
+    f.Close()
+    return n
+
+def process_file(filename, engine="kernel", single_pass=True, cache_dir=None, io_options=None):
+    """Returns (n_events, counts) for one ROOT file.
+
+    With a cache_dir, stored counts of an unchanged file are reused and only
+    the missing (variable, binning) pairs trigger an event loop. io_options are the
+    rootio options (read-ahead, staging) of the inputs.
+    """
+    entry = None
+    identity = file_identity(filename) if cache_dir else None
+    if identity is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path, entry = load_cache(cache_dir, identity)
+        counts = {key: entry["counts"][cache_key(key)] for key in unique_keys if cache_key(key) in entry["counts"]}
+        missing = [key for key in unique_keys if key not in counts]
+        if entry["n_events"] is not None and not missing:
+            return entry["n_events"], counts
+    else:
+        counts = {}
+        missing = unique_keys
+
+    # remote inputs can be read from a local copy of the branches the report needs
+    path, staged = rootio.stage_input(filename, io_options, [var for var, _b in missing])
+    if staged["staged"]:
+        print(f"Staged {filename}: {staged['bytes'] / 1024 ** 2:.1f} MB in {staged['seconds']:.1f} s")
+    try:
+        # Total events: from the tree metadata, otherwise counted in the same
+        # event loop as the ranges
+        n_events = tree_entries(path, io_options)
+        df = ROOT.RDataFrame("Events", path)
+        n_count = df.Count() if n_events is None else None
+        counts.update(compute_counts(df, missing, engine, single_pass))
+        if n_count is not None:
+            n_events = n_count.GetValue()
+    finally:
+        rootio.release_input(path, filename, io_options)
+
+    if entry is not None:
+        entry["n_events"] = n_events
+        for key in missing:
+            entry["counts"][cache_key(key)] = counts[key]
+        save_cache(cache_path, entry)
+    return n_events, counts
+
+def build_report(counts, scale):
+    """Print the per-variable ranges in ordered_vars order (duplicates included)
+    and return the spreadsheet lines."""
+    spreadsheet_output = []
+
+    print("\nVariables and ranges:\n")
+    print("====================================\n")
+
+    for var in ordered_vars:
+
+        print(f"=== {var} ===")
+
+        b = binning_for(var)
+        if b is not None:
+            c = counts[(var, b)]
+            for ir, label in enumerate(binnings[b][0]):
+                if c is None:
+                    print(f" {label:12}: Not found in the dataset")
+                    spreadsheet_output.append("Not found in the dataset")
+                else:
+                    val = c[ir] * scale
+                    print(f" {label:12}: {val:.2f}")
+                    spreadsheet_output.append(f"{val:.2f}")
+
+        print()  # Blank line between variables
+
+    return spreadsheet_output
+
+# ------------------------------------------
+# Batch mode
+# ------------------------------------------
+
+def expand_inputs(inputs):
+    """Expand files/globs into {sample: [files]}.
+
+    An input can be prefixed with "SAMPLE=" to name its sample, otherwise the
+    name of the parent directory is used (e.g. .../extraction/TT/x.root -> TT).
+    """
+    samples = {}
+    for item in inputs:
+        sample = None
+        if "=" in item and "/" not in item.split("=", 1)[0]:
+            sample, item = item.split("=", 1)
+        if glob.has_magic(item):
+            files = sorted(glob.glob(item))
+            if not files:
+                print(f"Warning: no file matches {item}")
+        else:
+            files = [item]
+        for f in files:
+            name = sample or os.path.basename(os.path.dirname(f.rstrip("/"))) or "sample"
+            samples.setdefault(name, []).append(f)
+    return samples
+
+def init_worker(threads, io_options=None):
+    # every worker gets its own ROOT thread pool and I/O settings
+    rootio.configure_io(io_options)
+    ROOT.ROOT.EnableImplicitMT(threads)
+
+def merge_counts(results):
+    """Sum n_events and the raw counts of several files of the same sample.
+
+    A key missing from any of the files is None (not found) for the sample:
+    its counts would otherwise be scaled by the events of files without it.
+    """
+    n_events = sum(n for n, _counts in results)
+    keys = list(dict.fromkeys(key for _n, counts in results for key in counts))
+    merged = {}
+    for key in keys:
+        found = [counts[key] for _n, counts in results if counts.get(key) is not None]
+        if len(found) < len(results):
+            if found:
+                print(f"Warning: {key[0]} is missing from {len(results) - len(found)} of {len(results)} files, "
+                      "reported as not found")
+            merged[key] = None
+        else:
+            merged[key] = [sum(x) for x in zip(*found)]
+    return n_events, merged
+
+def run_batch(samples, workers, threads, engine, single_pass, cache_dir=None, io_options=None):
+    """Process every file of every sample and return {sample: (n_events, counts)}."""
+    jobs = [(sample, f) for sample, files in samples.items() for f in files]
+    per_sample = {sample: [] for sample in samples}
+    if workers <= 1:
+        init_worker(threads, io_options)
+        for sample, f in jobs:
+            print(f"Processing {f}")
+            per_sample[sample].append(process_file(f, engine, single_pass, cache_dir, io_options))
+    else:
+        # spawn: every job is picklable, so each worker starts from a fresh
+        # ROOT. Forking (as prepare_training does) is only safe while no ROOT
+        # thread pool runs in the parent, which the single-file path enables
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=init_worker, initargs=(threads, io_options)) as pool:
+            futures = [(sample, f, pool.submit(process_file, f, engine, single_pass, cache_dir, io_options))
+                       for sample, f in jobs]
+            for sample, f, fut in futures:
+                per_sample[sample].append(fut.result())
+                print(f"Processed {f}")
+    return {sample: merge_counts(res) for sample, res in per_sample.items()}
+
+def write_batch_table(merged, out_csv):
+    """Print and write one scaled column (per 1e6 events) per sample."""
+    names = list(merged)
+    header = ["Variable", "Range"] + names
+    lines = ["\t".join(header)]
+    for var in ordered_vars:
+        b = binning_for(var)
+        if b is None:
+            continue
+        for ir, label in enumerate(binnings[b][0]):
+            row = [var, label]
+            for name in names:
+                n_events, counts = merged[name]
+                c = counts.get((var, b))
+                if c is None or n_events == 0:
+                    row.append("Not found in the dataset")
+                else:
+                    row.append(f"{c[ir] * 1e6 / n_events:.2f}")
+            lines.append("\t".join(row))
+
+    print("\nn_events per sample:")
+    for name in names:
+        print(f" {name}: {merged[name][0]}")
+    print("\nResults (tab-separated):\n")
+    for line in lines:
+        print(line)
+    with open(out_csv, "w") as fh:
+        for line in lines:
+            fh.write(",".join(line.split("\t")) + "\n")
+    print(f"\nWrote results to {out_csv}")
+
+# ------------------------------------------
+# Main
+# ------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coverage of the conditioning variables")
+    parser.add_argument("inputs", type=str, nargs="*", help="input ROOT files or globs, optionally as SAMPLE=glob")
+    parser.add_argument(
+        "--single_pass",
+        action=argparse.BooleanOptionalAction,
+        help="book all range counts on the same RDataFrame and read the file once "
+             "(histo and sum engines; the kernel engine always reads the file once)",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["kernel", "histo", "sum"],
+        help="kernel: one compiled counting action for all variables, "
+             "histo: one variable-bin-edge Histo1D per variable, sum: one boolean Sum per range",
+        default="kernel",
+        required=False,
+    )
+    parser.add_argument(
+        "--batch",
+        action=argparse.BooleanOptionalAction,
+        help="non-interactive mode: merge all inputs into one table per sample",
+        required=False,
+        default=False,
+    )
+    parser.add_argument("--workers", type=int, help="number of worker processes (batch mode)", default=1, required=False)
+    parser.add_argument(
+        "--threads", type=int, help="ROOT implicit-MT threads per worker (0: all cores split among workers)",
+        default=0, required=False,
+    )
+    parser.add_argument("--output", type=str, help="CSV written in batch mode", default="coverage_batch.csv", required=False)
+    parser.add_argument(
+        "--cache_dir", type=str, help="directory of the per-file count cache",
+        default=os.path.join(os.path.expanduser("~"), ".cache", "flashsim_coverage"), required=False,
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        help="reuse counts stored for unchanged files",
+        required=False,
+        default=True,
+    )
+    rootio.add_io_arguments(parser)
+    args = parser.parse_args()
+    if args.engine == "kernel" and args.single_pass is False:
+        parser.error("--no-single_pass does not apply to --engine kernel, use --engine histo or sum")
+    if args.single_pass is None:
+        args.single_pass = True
+    cache_dir = args.cache_dir if args.cache else None
+    io_options = rootio.io_options(args)
+    print("I/O settings:")
+    for line in rootio.describe(io_options):
+        print(f" {line}")
+
+    threads = args.threads
+    if threads <= 0:
+        threads = max(1, (os.cpu_count() or 1) // max(1, args.workers))
+
+    if args.batch or len(args.inputs) > 1:
+        samples = expand_inputs(args.inputs)
+        if not samples:
+            raise SystemExit("No input files. Exiting.")
+        merged = run_batch(samples, args.workers, threads, args.engine, args.single_pass, cache_dir, io_options)
+        write_batch_table(merged, args.output)
+        sys.exit(0)
+
+    # Provide filename by pasting the full path (no quotes) when prompted,
+    # or pass it as the first command-line argument.
+    if args.inputs:
+        filename = args.inputs[0].strip()
+    else:
+        filename = input("Paste full filename (no quotes), then press Enter: ").strip()
+
+    if not filename:
+        raise SystemExit("No filename provided. Exiting.")
+
+    init_worker(0 if args.threads <= 0 else args.threads, io_options)
+    n_events, counts = process_file(filename, args.engine, args.single_pass, cache_dir, io_options)
+    scale = 1e6 / n_events
+
+    spreadsheet_output = build_report(counts, scale)
+
+    # ------------------------------------------
+    # Final spreadsheet output
+    # ------------------------------------------
+    print("\nResults (to be pasted on the spreadsheet):\n")
+    for line in spreadsheet_output:
+        print(line)
@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
 import pickle
 import numpy as np
-import sys
 import os
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-if len(sys.argv) < 2:
-    print("Usage: python3 info_v1.py <parent_folder1> [<parent_folder2> ...]")
-    sys.exit(1)
+parser = argparse.ArgumentParser(description="Range counts of the conditioning variables per sample")
+parser.add_argument("parent_folders", type=str, nargs="+", help="extraction folders, one per sample")
+parser.add_argument("--workers", type=int, help="parent folders processed in parallel", default=1, required=False)
+parser.add_argument(
+    "--pool", type=str, choices=["process", "thread"], help="kind of worker pool used with --workers > 1",
+    default="process", required=False,
+)
+args = parser.parse_args()
 
-parent_folders = sys.argv[1:]
+parent_folders = args.parent_folders
 
 # Get n_events ONCE from an event_counts.json in any provider folder
 # Format examples inside event_counts.json: "SomeFile.root\t821232" or "SomeFile.root: 821232"
@@ -201,19 +208,64 @@ providers = [
 
 unique_providers = sorted(set(providers))
 
+def data_chunks(provider_folder, chunk_rows=1000000):
+    """Memory-mapped row chunks of data.npy, or of its shards (data_index.json)."""
+    data_path = os.path.join(provider_folder, "data.npy")
+    if os.path.isfile(data_path):
+        paths = [data_path]
+    else:
+        with open(os.path.join(provider_folder, "data_index.json"), "r") as fh:
+            index = json.load(fh)
+        paths = [os.path.join(provider_folder, s["file"]) for s in index["shards"] if s["rows"] > 0]
+    for path in paths:
+        data = np.load(path, mmap_mode="r")
+        for start in range(0, len(data), chunk_rows):
+            yield data[start:start + chunk_rows]
+
+def load_columns(provider_folder, cols):
+    """Read only the requested columns of a provider's data: {col: 1D array}."""
+    parts = {c: [] for c in cols}
+    for chunk in data_chunks(provider_folder):
+        block = np.asarray(chunk[:, cols])
+        for i, c in enumerate(cols):
+            parts[c].append(block[:, i].copy())
+    return {c: np.concatenate(v) if v else np.zeros(0) for c, v in parts.items()}
+
+def load_summary(provider_folder):
+    """The summary.json written by prepare_training, or None if it is missing
+    or older than data.npy."""
+    path = os.path.join(provider_folder, "summary.json")
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r") as fh:
+            summary = json.load(fh)
+    except Exception:
+        return None
+    data_path = os.path.join(provider_folder, "data.npy")
+    if os.path.isfile(data_path):
+        stat = os.stat(data_path)
+        if (stat.st_size, stat.st_mtime_ns) != (summary["data"]["size"], summary["data"]["mtime_ns"]):
+            return None
+    return summary
+
 def load_models_for_parent(parent_folder):
+    """Config, column map and summary of every provider; the data is read
+    later, per provider and column, by load_columns."""
     models_local = {}
     for name in unique_providers:
         p = os.path.join(parent_folder, name)
         cfg_path = os.path.join(p, "config.pkl")
-        data_path = os.path.join(p, "data.npy")
-        if os.path.isfile(cfg_path) and os.path.isfile(data_path):
+        summary = load_summary(p)
+        has_data = (os.path.isfile(os.path.join(p, "data.npy")) or os.path.isfile(os.path.join(p, "data_index.json"))
+                    or summary is not None)
+        if os.path.isfile(cfg_path) and has_data:
             try:
                 cfg = pickle.load(open(cfg_path, "rb"))
-                dat = np.load(data_path)
                 all_vars = cfg.get("conditioning_features", []) + cfg.get("target_features", [])
                 var2col = {v: i for i, v in enumerate(all_vars)}
-                models_local[name] = {"path": p, "config": cfg, "data": dat, "var2col": var2col, "scale": scale}
+                models_local[name] = {"path": p, "config": cfg, "var2col": var2col, "scale": scale,
+                                      "summary": summary}
             except Exception:
                 models_local[name] = None
         else:
@@ -255,8 +307,78 @@ dr_vars = {
     "GenMuon_ClosestGenJet_DeltaR", "Jet_GenMuonDr", "MatchedJet_ClosestGenVisTau_DeltaR"
 }
 
-def count_range(arr, cond):
-    return np.sum(cond(arr))
+inf = np.inf
+
+# Binnings: (labels, edges, right). With right=True the ranges are (a, b] and
+# the first one is closed, [a, b]; with right=False they are [a, b) and the
+# last one is closed. Open-ended ranges use -inf/inf as edge.
+binnings = {
+    "pt_mass": (("0-100", "100-1000", ">1000"), (0, 100, 1000, inf), True),
+    "sv": (("0-1",   # Light flavor-ish
+            "1-2",   # Charm-ish
+            "2-4",   # Bottom-ish (peak)
+            "4-6",   # Bottom-ish (tail)
+            "6-10",  # Mostly unknown
+            ">10"),  # Mythological
+           (0, 1, 2, 4, 6, 10, inf), True),
+    "fake_jet_pt": (("0-100", "100-1000", ">1000"), (0, 100, 1000, inf), True),
+    "ClosestGenVisTau_mass": (("<1.2",   # 1-prong decays
+                               "1.2-2",  # pi0s
+                               "2-5",    # Multi-prong visible decays
+                               ">5"),
+                              (-inf, 1.2, 2, 5, inf), True),
+    "dr": (("<0.4", "≥0.4"), (-inf, 0.4, inf), False),
+}
+no_binning = ((), (), True)
+
+def count_ranges(x, binning):
+    """Counts of every range of a binning, from a single pass over x.
+
+    Edges are compared in the dtype of x, as the comparisons x > edge with
+    Python floats do.
+    """
+    labels, edges, right = binning
+    dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+    e = np.asarray(edges, dtype=dtype)
+    if right:
+        # edges[i-1] < x <= edges[i] -> i; the lowest edge is included
+        idx = np.searchsorted(e, x, side="left")
+        idx[x == e[0]] = 1
+    else:
+        # edges[i-1] <= x < edges[i] -> i; the highest edge is included
+        idx = np.searchsorted(e, x, side="right")
+        idx[x == e[-1]] = len(e) - 1
+    # NaNs sort past the last edge and are never counted
+    return np.bincount(idx, minlength=len(e) + 1)[1:len(e)]
+
+def summary_counts(summary, col, binning):
+    """Counts of every range of a binning from a provider summary, or None if
+    one of its edges is not on the summary grid.
+
+    The summary holds exact counts of the atoms of its grid g (x < g0,
+    x == g0, g0 < x < g1, ..., x > gn), so any range between grid edges is a
+    sum of atoms. -inf only appears as a closed lower edge and inf as a closed
+    upper edge.
+    """
+    labels, edges, right = binning
+    dtype = np.dtype(summary["dtype"])
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.dtype(np.float64)
+    grid = {e: k for k, e in enumerate(summary["edges"])}
+    e = [float(v) for v in np.asarray(edges, dtype=dtype)]
+    if any(np.isfinite(v) and v not in grid for v in e):
+        return None
+    cum = np.concatenate([[0], np.cumsum(summary["columns"][col]["atoms"])])
+    counts = []
+    for i in range(len(labels)):
+        a, b = e[i], e[i + 1]
+        # (a, b] or [a, b); the first (right) or last (not right) range is closed
+        lo_closed = not right or i == 0
+        hi_closed = right or i == len(labels) - 1
+        start = 0 if a == -np.inf else 2 * grid[a] + (1 if lo_closed else 2)
+        end = len(cum) - 1 if b == np.inf else 2 * grid[b] + (2 if hi_closed else 1)
+        counts.append(int(cum[end] - cum[start]))
+    return counts
 
 print("\nVariables and ranges (parents: %s)\n" % ", ".join(parent_folders))
 print("====================================\n")
@@ -266,79 +388,86 @@ ranges_per_var = []
 for i, var in enumerate(ordered_vars):
     # determine ranges for this variable
     if var in pt_mass_vars:
-        ranges = [
-            ("0-100",  lambda x: (x >= 0) & (x <= 100)),
-            ("100-1000", lambda x: (x > 100) & (x <= 1000)),
-            (">1000", lambda x: x > 1000)
-        ]
+        binning = binnings["pt_mass"]
     elif var in sv_vars:
-        ranges = [
-            ("0-1",  lambda x: (x >= 0) & (x <= 1)), # Light flavor-ish
-            ("1-2", lambda x: (x > 1) & (x <= 2)), # Charm-ish
-            ("2-4", lambda x: (x > 2) & (x <= 4)), # Bottom-ish (peak)
-            ("4-6", lambda x: (x > 4) & (x <= 6)), # Bottom-ish (tail)
-            ("6-10", lambda x: (x > 6) & (x <= 10)), # Mostly unknown
-            (">10", lambda x: x > 10) # Mythological
-        ]
+        binning = binnings["sv"]
     elif var in fake_jet_pt_vars:
-        ranges = [
-            ("0-100",  lambda x: (x >= 0) & (x <= 100)),
-            ("100-1000", lambda x: (x > 100) & (x <= 1000)),
-            (">1000", lambda x: x > 1000)
-        ]
+        binning = binnings["fake_jet_pt"]
     elif var in ClosestGenVisTau_mass_vars:
-        ranges = [
-            ("<1.2",  lambda x: x <= 1.2), # 1-prong decays
-            ("1.2-2", lambda x: (x > 1.2) & (x <= 2)), # pi0s
-            ("2-5", lambda x: (x > 2) & (x <= 5)), # Multi-prong visible decays
-            (">5", lambda x: x > 5)
-        ]
+        binning = binnings["ClosestGenVisTau_mass"]
     elif var in dr_vars:
-        ranges = [
-            ("<0.4", lambda x: x < 0.4),
-            ("≥0.4", lambda x: x >= 0.4)
-        ]
+        binning = binnings["dr"]
     else:
-        ranges = []
-    ranges_per_var.append((var, providers[i], ranges))
+        binning = no_binning
+    ranges_per_var.append((var, providers[i], binning))
 
 # Total number of rows
-rows = sum(len(rngs) for (_, _, rngs) in ranges_per_var)
+rows = sum(len(binning[0]) for (_, _, binning) in ranges_per_var)
 
 # For each parent folder, load models and compute column values
-all_columns = []
-parent_n_events = []
-for parent in parent_folders:
+def compute_parent_column(parent):
+    """n_events and the column of counts (one entry per row) of one parent folder."""
     print(f"Processing parent: {parent}")
     models = load_models_for_parent(parent)
     n_events_local = get_n_events_from_folder(parent)
-    parent_n_events.append(n_events_local)
-    col_values = []
-    for var, provider, ranges in ranges_per_var:
+
+    # one provider at a time, reading only the columns its variables use
+    var_values = [None] * len(ranges_per_var)
+    for provider in unique_providers:
+        entries = [i for i, (_var, prov, _binning) in enumerate(ranges_per_var) if prov == provider]
         model_info = models.get(provider)
         if model_info is None:
-            # provider missing -> append zeros for each range
-            for _ in ranges:
-                col_values.append(0)
+            # provider missing -> zeros for each range
+            for i in entries:
+                var_values[i] = [0] * len(ranges_per_var[i][2][0])
             continue
 
         var2col = model_info["var2col"]
-        data = model_info["data"]
         scale = model_info.get("scale", 1)
-
-        if var not in var2col:
-            for _ in ranges:
-                col_values.append(0)
-            continue
-
-        col = var2col[var]
-        x = data[:, col]
-        for _label, cond_func in ranges:
-            val = int(count_range(x, cond_func) * scale)
-            col_values.append(val)
-
-    # if there were no ranges at all for any var, ensure empty list
-    all_columns.append(col_values)
+        # variables sharing a column and binning are counted once; the summary
+        # answers what it can, the raw columns are read only for the rest
+        counts_cache = {}
+        summary = model_info.get("summary")
+        if summary is not None:
+            for i in entries:
+                var, _provider, binning = ranges_per_var[i]
+                if var in var2col and binning[0]:
+                    counts = summary_counts(summary, var2col[var], binning)
+                    if counts is not None:
+                        counts_cache[(var2col[var], binning)] = counts
+        cols = sorted({var2col[ranges_per_var[i][0]] for i in entries if ranges_per_var[i][0] in var2col
+                       and (var2col[ranges_per_var[i][0]], ranges_per_var[i][2]) not in counts_cache})
+        try:
+            columns = load_columns(model_info["path"], cols) if cols else {}
+        except Exception:
+            columns = None
+
+        for i in entries:
+            var, _provider, binning = ranges_per_var[i]
+            key = (var2col.get(var), binning)
+            if var not in var2col or (columns is None and key not in counts_cache):
+                var_values[i] = [0] * len(binning[0])
+                continue
+            if key not in counts_cache:
+                counts_cache[key] = count_ranges(columns[var2col[var]], binning) if binning[0] else []
+            var_values[i] = [int(c * scale) for c in counts_cache[key]]
+        del columns
+
+    return n_events_local, [v for values in var_values for v in values]
+
+# Parents are independent: with --workers they run in a pool (fork, so the
+# workers share ranges_per_var) and the columns are kept in input order
+if args.workers > 1 and len(parent_folders) > 1:
+    if args.pool == "thread":
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+    else:
+        pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("fork"))
+    with pool:
+        parent_results = list(pool.map(compute_parent_column, parent_folders))
+else:
+    parent_results = [compute_parent_column(parent) for parent in parent_folders]
+parent_n_events = [n for n, _col in parent_results]
+all_columns = [col for _n, col in parent_results]
 
 # Print header showing n_events per parent (optional)
 print('\nn_events per parent:')
@@ -376,11 +505,11 @@ else:
 
     # Prepare textual rows corresponding to ranges_per_var
     text_rows = []
-    for var, provider, ranges in ranges_per_var:
+    for var, provider, binning in ranges_per_var:
         # conditioning variable: drop the first token before the first underscore
         cond = var.split('_', 1)[1] if '_' in var else var
         obj = provider_to_object.get(provider, '')
-        for label, _cond in ranges:
+        for label in binning[0]:
             text_rows.append([obj, provider, cond, label])
 
     # Print to stdout (tab-separated), combining text and numeric columns
@@ -10,10 +10,22 @@ import ROOT
 from array import array
 from flashsim.training.generate_varprocessors import save_processors
 from flashsim.common.event import FlashSimEvent
+import rootio
 import os
+import shutil
+import tempfile
+import time
+import resource
+import cProfile
+import contextlib
+import fcntl
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pickle
 import torch
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import tqdm
 import yaml
@@ -23,191 +35,830 @@ yaml.add_representer(dict, dict_representer)
 
 #np.seterr(all='raise')
 
-def prepare_training(config, folder, inputfiles, name,skip_extraction=False, skip_plots=False, debug=False):
+def entry_ranges(totevents, batch_size):
+    """Entry ranges processed one RDataFrame at a time; [None] means the whole tree at once."""
+    if batch_size <= 0:
+        return [None]
+    batches = int(totevents / batch_size)+1
+    return [(batch * batch_size, (batch + 1) * batch_size) for batch in range(batches)]
+
+def npy_header(path):
+    """(shape, dtype) of a .npy file, read from its header only."""
+    with open(path, "rb") as fh:
+        version = np.lib.format.read_magic(fh)
+        if version == (1, 0):
+            shape, _fortran, dtype = np.lib.format.read_array_header_1_0(fh)
+        else:
+            shape, _fortran, dtype = np.lib.format.read_array_header_2_0(fh)
+    return shape, dtype
+
+def merge_npy(parts, out, chunk_rows=1000000):
+    """Concatenate the rows of several .npy files into out, chunk by chunk."""
+    parts = [p for p in parts if os.path.exists(p)]
+    if not parts:
+        return
+    if len(parts) == 1:
+        os.replace(parts[0], out)
+        return
+    headers = [npy_header(p) for p in parts]
+    total = sum(shape[0] for shape, _dtype in headers)
+    shape, dtype = headers[0]
+    merged = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=(total,) + tuple(shape[1:]))
+    start = 0
+    for p, (shape, _dtype) in zip(parts, headers):
+        if shape[0] == 0:
+            continue
+        data = np.load(p, mmap_mode="r")
+        for i in range(0, len(data), chunk_rows):
+            block = data[i:i + chunk_rows]
+            merged[start:start + len(block)] = block
+            start += len(block)
+        del data
+        os.remove(p)
+    merged.flush()
+    del merged
+
+def scatter_rows(sources, tmpdir, nbuckets, rng, chunk_rows):
+    """Append the rows of sources (arrays, read chunk_rows at a time) to
+    nbuckets bucket files in tmpdir, each row to a random one."""
+    buckets = [os.path.join(tmpdir, f"{b}.bin") for b in range(nbuckets)]
+    handles = [open(b, "wb") for b in buckets]
+    for data in sources:
+        for i in range(0, len(data), chunk_rows):
+            block = np.asarray(data[i:i + chunk_rows])
+            ids = rng.integers(nbuckets, size=len(block))
+            order = np.argsort(ids, kind="stable")
+            bounds = np.cumsum(np.bincount(ids, minlength=nbuckets))[:-1]
+            for fh, rows in zip(handles, np.split(block[order], bounds)):
+                rows.tofile(fh)
+    for fh in handles:
+        fh.close()
+    return buckets
+
+def gather_buckets(buckets, merged, start, rng, chunk_rows, max_buckets):
+    """Shuffle every bucket and write it to merged from row start on, in turn.
+
+    A bucket of more than chunk_rows rows is scattered again into smaller
+    buckets instead of being loaded. Returns the row after the last one written.
+    """
+    rowshape = merged.shape[1:]
+    rowbytes = merged.dtype.itemsize * int(np.prod(rowshape))
+    for bucket in buckets:
+        n = os.path.getsize(bucket) // rowbytes
+        if n > chunk_rows:
+            tmpdir = tempfile.mkdtemp(dir=os.path.dirname(bucket))
+            data = np.memmap(bucket, dtype=merged.dtype, mode="r", shape=(n,) + rowshape)
+            sub = scatter_rows([data], tmpdir, min(-(-n // chunk_rows), max_buckets), rng, chunk_rows)
+            del data
+            os.remove(bucket)
+            start = gather_buckets(sub, merged, start, rng, chunk_rows, max_buckets)
+            shutil.rmtree(tmpdir)
+            continue
+        rows = np.fromfile(bucket, dtype=merged.dtype).reshape((-1,) + rowshape)
+        rng.shuffle(rows)
+        merged[start:start + len(rows)] = rows
+        start += len(rows)
+        os.remove(bucket)
+    return start
+
+def shuffle_npy(parts, out, seed=None, chunk_rows=1000000, max_buckets=256):
+    """Write the rows of several .npy files to out in a uniformly random order,
+    with bounded memory.
+
+    Rows are read chunk_rows at a time and scattered to at most max_buckets
+    random bucket files, then every bucket is shuffled in memory and written
+    out in turn. Buckets larger than chunk_rows are scattered again, so no
+    more than about chunk_rows rows are in memory whatever the size of the
+    data. The parts are removed, out may be one of them.
+    """
+    parts = [p for p in parts if os.path.exists(p)]
+    if not parts:
+        return
+    headers = [npy_header(p) for p in parts]
+    n = sum(shape[0] for shape, _dtype in headers)
+    shape, dtype = headers[0]
+    shape = (n,) + tuple(shape[1:])
+    rng = np.random.default_rng(seed)
+    nbuckets = min(max(1, -(-n // chunk_rows)), max_buckets)
+    tmp = out + ".shuffled"
+    if nbuckets == 1:
+        data = np.concatenate([np.load(p) for p in parts]) if len(parts) > 1 else np.load(parts[0])
+        rng.shuffle(data)
+        with open(tmp, "wb") as fh:
+            np.save(fh, data)
+        del data
+    else:
+        tmpdir = tempfile.mkdtemp(dir=os.path.dirname(out) or ".")
+        sources = (np.load(p, mmap_mode="r") for p, (pshape, _dtype) in zip(parts, headers) if pshape[0] > 0)
+        buckets = scatter_rows(sources, tmpdir, nbuckets, rng, chunk_rows)
+        merged = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=shape)
+        gather_buckets(buckets, merged, 0, rng, chunk_rows, max_buckets)
+        merged.flush()
+        del merged
+        shutil.rmtree(tmpdir)
+    os.replace(tmp, out)
+    for p in parts:
+        if p != out and os.path.exists(p):
+            os.remove(p)
+
+def write_shards(folder, stem, shard_rows, columns=None):
+    """Split folder/<stem>.npy into fixed-size shards plus a JSON index.
+
+    Shards are written to folder/<stem>_shards/ and described by
+    folder/<stem>_index.json (rows per shard, column names and dtype).
+    """
+    path = os.path.join(folder, stem + ".npy")
+    sharddir = os.path.join(folder, stem + "_shards")
+    if os.path.exists(sharddir):
+        shutil.rmtree(sharddir)
+    os.makedirs(sharddir)
+    data = np.load(path, mmap_mode="r") if npy_header(path)[0][0] > 0 else np.load(path)
+    shards = []
+    for i, start in enumerate(range(0, len(data), shard_rows)):
+        fname = f"{stem}_{i:05d}.npy"
+        block = np.asarray(data[start:start + shard_rows])
+        np.save(os.path.join(sharddir, fname), block)
+        shards.append({"file": os.path.join(stem + "_shards", fname), "rows": int(len(block))})
+    index = {
+        "rows": int(len(data)),
+        "columns": columns,
+        "dtype": np.dtype(data.dtype).str,
+        "shape": list(data.shape[1:]),
+        "shards": shards,
+    }
+    del data
+    with open(os.path.join(folder, stem + "_index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+def index_shard_rows(folder, stem):
+    """Rows per shard of an existing folder/<stem>_index.json, or 0 if there is none."""
+    index_path = os.path.join(folder, stem + "_index.json")
+    if not os.path.exists(index_path):
+        return 0
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    return max([s["rows"] for s in index["shards"]], default=0)
+
+def input_fingerprint(inputfile):
+    """Size and UUID of a ROOT file, which change whenever its content is rewritten."""
+    f = ROOT.TFile.Open(inputfile)
+    fingerprint = f"{f.GetSize()}:{f.GetUUID().AsString()}"
+    f.Close()
+    return fingerprint
+
+def pending_inputs(folder, inputfiles, fingerprints):
+    """Indices of the input files not yet extracted in folder.
+
+    A file counts as extracted when its name is in event_counts.json and its
+    fingerprint matches the one in extracted_inputs.json. Folders extracted
+    before fingerprints were recorded are trusted by name.
+    """
+    event_counts, extracted = {}, None
+    if os.path.exists(os.path.join(folder, "event_counts.json")):
+        with open(os.path.join(folder, "event_counts.json"), "r") as f:
+            event_counts = json.load(f)
+    if os.path.exists(os.path.join(folder, "extracted_inputs.json")):
+        with open(os.path.join(folder, "extracted_inputs.json"), "r") as f:
+            extracted = json.load(f)
+    if not os.path.exists(os.path.join(folder, "data.npy")):
+        return list(range(len(inputfiles)))
+    todo = []
+    for ifile, (inputfile, fingerprint) in enumerate(zip(inputfiles, fingerprints)):
+        key = os.path.basename(inputfile)
+        if key not in event_counts:
+            todo.append(ifile)
+        elif extracted is None:
+            logger.warning("no fingerprint recorded for %s, assuming it is extracted", key)
+        elif key not in extracted:
+            todo.append(ifile)
+        elif extracted[key]["fingerprint"] != fingerprint:
+            raise ValueError(f"{inputfile} changed since it was extracted, run without --incremental")
+    return todo
+
+def write_json_atomic(path, obj):
+    """Write obj to path through a temporary file and a rename, so readers never see half a file."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+def write_event_record(folder, result):
+    """Store the bookkeeping of one extracted input file in folder/event_counts.d/."""
+    recdir = os.path.join(folder, "event_counts.d")
+    os.makedirs(recdir, exist_ok=True)
+    record = {k: result[k] for k in ["file", "events", "rows", "rows_eff", "fingerprint"]}
+    write_json_atomic(os.path.join(recdir, result["file"] + ".json"), record)
+
+def merge_event_records(folder):
+    """Fold the per-file records into event_counts.json ({file: events}) and
+    extracted_inputs.json (events, rows and fingerprint per file).
+
+    The read, list and write run under an exclusive lock on
+    folder/event_counts.lock, so concurrent merges are serialized and every
+    merge sees the records of the merges before it.
+    """
+    recdir = os.path.join(folder, "event_counts.d")
+    if not os.path.isdir(recdir):
+        return
+    with open(os.path.join(folder, "event_counts.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        event_counts, extracted = {}, {}
+        if os.path.exists(os.path.join(folder, "event_counts.json")):
+            with open(os.path.join(folder, "event_counts.json"), "r") as f:
+                event_counts = json.load(f)
+        if os.path.exists(os.path.join(folder, "extracted_inputs.json")):
+            with open(os.path.join(folder, "extracted_inputs.json"), "r") as f:
+                extracted = json.load(f)
+        for fname in sorted(os.listdir(recdir)):
+            if not fname.endswith(".json"):
+                continue
+            with open(os.path.join(recdir, fname), "r") as f:
+                record = json.load(f)
+            # use the ROOT filename as key
+            event_counts[record["file"]] = record["events"]
+            extracted[record["file"]] = {k: record[k] for k in ["fingerprint", "events", "rows", "rows_eff"]}
+        write_json_atomic(os.path.join(folder, "event_counts.json"), event_counts)
+        write_json_atomic(os.path.join(folder, "extracted_inputs.json"), extracted)
+        # the lock is released when the file is closed
+
+def set_out_types(config, inputfile):
+    rdf=ROOT.RDataFrame("Events",inputfile)
+    config["out_types"] = {}
+    for c in config["target_features"]:
+        config["out_types"][c] = rdf.GetColumnType(c)
+
+def io_bytes_written():
+    """Bytes written by this process so far (wchar of /proc/self/io), None where unavailable."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss():
+    """Reset the peak RSS (VmHWM) of this process; False where the kernel does not allow it."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """VmHWM of this process in MB, the peak RSS since the last reset_peak_rss()."""
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+class StageProfile:
+    """Wall time, CPU time, peak RSS, events, bytes written and RDF event
+    loops of the stages of prepare_training, written to profile.json.
+
+    CPU time includes the worker processes reaped during a stage. peak_rss_mb
+    is the peak of this process during the stage (VmHWM, reset at stage
+    entry); where it cannot be reset, peak_rss_so_far_mb is the lifetime
+    peak instead. children_peak_rss_so_far_mb is always a lifetime value:
+    the peak of the largest worker reaped so far. A stage entered again
+    accumulates into the same record.
+    """
+    def __init__(self):
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        rec = self.stages.setdefault(name, {"start": time.time(), "wall_s": 0.0, "cpu_s": 0.0,
+                                            "events": 0, "bytes_written": 0, "rdf_loops": 0})
+        wall, cpu, written = time.perf_counter(), time.process_time(), io_bytes_written()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        reset = reset_peak_rss()
+        try:
+            yield rec
+        finally:
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            rec["wall_s"] += time.perf_counter() - wall
+            rec["cpu_s"] += (time.process_time() - cpu + after.ru_utime - children.ru_utime
+                             + after.ru_stime - children.ru_stime)
+            now = io_bytes_written()
+            if written is not None and now is not None:
+                rec["bytes_written"] += now - written
+            # ru_maxrss is in kB on Linux
+            if reset:
+                rec["peak_rss_mb"] = max(rec.get("peak_rss_mb", 0), peak_rss_mb())
+            else:
+                rec["peak_rss_so_far_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            rec["children_peak_rss_so_far_mb"] = after.ru_maxrss / 1024
+
+    def write(self, path, **extra):
+        write_json_atomic(path, dict({"pid": os.getpid(), "stages": self.stages}, **extra))
+
+def write_debug_snapshot(rdf, config, path, debug_options=None):
+    """Write a compressed Snapshot of the debug columns of rdf into path.
+
+    debug_options may set "algorithm"/"level" (compression), "every" (keep one
+    event in N) and "columns" (only keep these of the default columns).
+    """
+    debug_options = debug_options or {}
+    if isinstance(config["matching"]["target_mask"],str):
+        columns = (config["target_features"]+config["conditioning_features"]+[config["matching"]["target_mask"],config["matching"]["conditioning_index"]]
+                   +["M"+x for x in config["target_features"]+config["conditioning_features"]])
+    else:
+        columns = (config["target_features"]+config["conditioning_features"]+
+                   config["matching"]["target_mask"]+config["matching"]["conditioning_index"]+
+                   ["M"+x for x in config["target_features"]+config["conditioning_features"]])
+    if debug_options.get("columns"):
+        columns = [c for c in columns if c in debug_options["columns"]]
+    # drop duplicates and the "" placeholder column
+    columns = [c for c in dict.fromkeys(columns) if c]
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fCompressionAlgorithm = getattr(ROOT.ROOT.RCompressionSetting.EAlgorithm,
+                                         "k" + debug_options.get("algorithm", "zlib").upper())
+    opts.fCompressionLevel = debug_options.get("level", 1)
+    every = debug_options.get("every", 1)
+    if every > 1:
+        rdf = rdf.Filter(f"rdfentry_ % {every} == 0", "debug subsample")
+    return rdf.Snapshot("Events", path, columns, opts)
+
+def extract_file(config, name, partfolder, inputfile, ifile, folder, debug=False, batch_size=100000,
+                 debug_options=None, profile_modules=False, io_options=None):
+    """Run the dataset modules over one input file.
+
+    The modules write data.npy (and data_eff.npy) in partfolder, debug files go
+    to folder. Returns the file name, its Events entries, the out_types and
+    what the profile needs: seconds per module, RDF event loops, bytes written.
+    With profile_modules every o.run() is profiled with cProfile and dumped to
+    folder/profile/<module>_<ifile>_<batch>.prof. io_options are the rootio options
+    (read-ahead, staging) of the input.
+    """
+    if not os.path.exists(partfolder):
+        os.makedirs(partfolder)
+    sequence = [
+      FlashSimTrainingDatasetModule(name, config, partfolder),
+    ]
+    if config["type"] == "vector":
+      sequence.append(FlashSimEfficiencyDatasetModule(name, config, partfolder))
+
+    # the branches the modules read are not known upfront: staging copies
+    # the whole file and the cache learns the branches that are read
+    inputpath, staged = rootio.stage_input(inputfile, io_options)
+    # process-wide counter: with implicit MT RDataFrame reads through its own files
+    read_before = ROOT.TFile.GetFileBytesRead()
+    original = inputfile
+    inputfile = ROOT.TFile.Open(inputpath)
+    inputtree = inputfile.Get("Events")
+    rootio.tune_tree(inputtree, io_options)
+    events = FlashSimEvent()
+    totevents=inputtree.GetEntries()
+
+    # with batch_size <= 0 the Defines of every module are jitted once per
+    # file and the whole tree is processed multithreaded in a single pass
+    batches = entry_ranges(totevents, batch_size)
+    pbar = tqdm.tqdm(batches)
+    rdf_loops = 0
+    module_seconds = {}
+    if profile_modules:
+        os.makedirs(os.path.join(folder, "profile"), exist_ok=True)
+    for j, batch in enumerate(pbar):
+        logger.debug("batch %s" % (batch,))
+        # create rdf
+        graph = ROOT.RDataFrame(inputtree)
+        rdf = graph
+        if batch is not None:
+            rdf = rdf.Range(*batch)
+        events.new_batch(rdf)
+        for o in sequence:
+            logger.debug(o)
+            module = type(o).__name__
+            start = time.perf_counter()
+            if profile_modules:
+                prof = cProfile.Profile()
+                events = prof.runcall(o.run, events)
+                prof.dump_stats(os.path.join(folder, "profile", f"{module}_{ifile}_{j}.prof"))
+            else:
+                events = o.run(events)
+            module_seconds[module] = module_seconds.get(module, 0.0) + time.perf_counter() - start
+
+        if "out_types" not in config:
+            config["out_types"] = {}
+            for c in config["target_features"]:
+                config["out_types"][c] = events.rdf.GetColumnType(c)
+        if debug:
+            # the modules have already run their event loop through their
+            # writers, so the snapshot is written now, with its own loop;
+            # no batch graph is kept past its batch
+            logger.debug("saving debug data")
+            write_debug_snapshot(events.rdf, config, os.path.join(folder, f"debug_data_{ifile}_{j}.root"),
+                                 debug_options)
+        rdf_loops += int(graph.GetNRuns())
+        del graph, rdf
+
+    for m in sequence:
+      m.out.close()
+    rows = {}
+    written = 0
+    for out in ["data", "data_eff"]:
+        path = os.path.join(partfolder, out + ".npy")
+        rows[out] = int(npy_header(path)[0][0]) if os.path.exists(path) else 0
+        written += os.path.getsize(path) if os.path.exists(path) else 0
+    if debug:
+        written += sum(os.path.getsize(os.path.join(folder, f"debug_data_{ifile}_{j}.root"))
+                       for j in range(len(batches)) if os.path.exists(os.path.join(folder, f"debug_data_{ifile}_{j}.root")))
+    result = {
+        "file": os.path.basename(original),
+        "events": int(totevents),
+        "rows": rows["data"],
+        "rows_eff": rows["data_eff"],
+        "fingerprint": f"{inputfile.GetSize()}:{inputfile.GetUUID().AsString()}",
+        "out_types": config.get("out_types"),
+        "module_seconds": module_seconds,
+        "rdf_loops": rdf_loops,
+        "bytes_written": written,
+        "bytes_read": int(ROOT.TFile.GetFileBytesRead() - read_before),
+        "staged": staged,
+    }
+    # (a staged copy can be unlinked while the file is open)
+    rootio.release_input(inputpath, original, io_options)
+    return result
+
+# set before forking the extraction workers, which inherit it: the config
+# is not guaranteed to be picklable
+_extraction_job = None
+
+def init_extraction_worker(batch_size, threads, io_options=None):
+    rootio.configure_io(io_options)
+    if batch_size <= 0:
+        # one graph per file: Range() would disable implicit multithreading
+        ROOT.EnableImplicitMT(threads)
+
+def run_extraction_job(ifile):
+    (config, name, folder, inputfiles, debug, batch_size, debug_options, profile_modules,
+     io_options) = _extraction_job
+    partfolder = os.path.join(folder, "parts", str(ifile))
+    return extract_file(config, name, partfolder, inputfiles[ifile], ifile, folder, debug, batch_size,
+                        debug_options, profile_modules, io_options)
+
+def transform_batch(batch, training_phy2nn, inference_nn2phy, ncond, with_phys=True):
+    """orig_phys, transformed and (optionally) back-transformed phys of a batch of rows, as numpy."""
+    orig_phys=torch.tensor(np.asarray(batch))
+    with torch.no_grad():
+        transformed=training_phy2nn(orig_phys)
+        phys=None
+        if with_phys:
+            phys=inference_nn2phy(torch.cat(
+              (
+              transformed[:,ncond:],
+              orig_phys[:,:ncond],
+              ) ,
+            dim=1)).detach().numpy()
+    return orig_phys.numpy(), transformed.detach().numpy(), phys
+
+def sanitize_nonfinite(report, arrays, row_ids, max_samples=5):
+    """Count the NaN/+Inf/-Inf values of every column of each named array,
+    keep a few offending rows per column in report, then zero them in place.
+
+    arrays maps a name to (array, column names); row_ids are the data.npy
+    rows of the batch.
+    """
+    for name, (x, columns) in arrays.items():
+        nan, posinf, neginf = np.isnan(x), np.isposinf(x), np.isneginf(x)
+        bad = nan | posinf | neginf
+        for ic in np.flatnonzero(bad.any(axis=0)):
+            entry = report.setdefault(columns[ic], {}).setdefault(
+                name, {"nan": 0, "posinf": 0, "neginf": 0, "sample_rows": [], "sample_values": []})
+            entry["nan"] += int(nan[:, ic].sum())
+            entry["posinf"] += int(posinf[:, ic].sum())
+            entry["neginf"] += int(neginf[:, ic].sum())
+            room = max_samples - len(entry["sample_rows"])
+            if room > 0:
+                entry["sample_rows"] += [int(r) for r in row_ids[bad[:, ic]][:room]]
+                entry["sample_values"] += [str(v) for v in x[bad[:, ic], ic][:room]]
+        x[bad] = 0
+
+def widen_empty_range(lo, hi):
+    """Per-column histogram range as np.histogram_bin_edges makes it: +-0.5 around constant columns."""
+    lo = np.asarray(lo, dtype=np.float64).copy()
+    hi = np.asarray(hi, dtype=np.float64).copy()
+    same = lo == hi
+    lo[same] -= 0.5
+    hi[same] += 0.5
+    return lo, hi
+
+def histogram_columns(x, lo, hi, nbins=100):
+    """Histogram every column of x at once: counts[col, bin] over [lo, hi] per column.
+
+    Like np.histogram, the last bin is closed and values outside the range are dropped.
+    """
+    ncols = x.shape[1]
+    if ncols == 0:
+        return np.zeros((0, nbins), dtype=np.int64)
+    idx = np.floor((x - lo) / ((hi - lo) / nbins)).astype(np.int64)
+    np.clip(idx, 0, nbins - 1, out=idx)
+    inside = (x >= lo) & (x <= hi)
+    flat = (idx + np.arange(ncols) * nbins)[inside]
+    return np.bincount(flat, minlength=ncols * nbins).reshape(ncols, nbins)
+
+# Edge grid of the per-column summary: every binning edge used by info_v1.py
+# is on it, so its range counts can be answered exactly from summary.json
+summary_edges = (-1, 0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.8, 1, 1.2, 1.5, 2, 3, 4, 5, 6, 8, 10,
+                 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+def write_summary(folder, columns, nbins=100, chunk_rows=1000000):
+    """Write folder/summary.json, a compact per-column summary of data.npy.
+
+    For every column: non-finite counts, finite min/max, a histogram of nbins
+    over [min, max] and exact counts of the "atoms" of summary_edges (x < e0,
+    x == e0, e0 < x < e1, x == e1, ..., x > en), with the edges compared in
+    the dtype of the data. NaNs are not in the atoms, +-inf are.
+    """
+    path = os.path.join(folder, "data.npy")
+    data = np.load(path, mmap_mode="r")
+    ncols = data.shape[1]
+    dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.dtype(np.float64)
+    grid = np.unique(np.asarray(summary_edges, dtype=dtype))
+    atoms = np.zeros((ncols, 2 * len(grid) + 1), dtype=np.int64)
+    nan, posinf, neginf = (np.zeros(ncols, dtype=np.int64) for _ in range(3))
+    lo, hi = np.full(ncols, np.inf), np.full(ncols, -np.inf)
+    for start in range(0, len(data), chunk_rows):
+        x = np.asarray(data[start:start + chunk_rows])
+        isnan = np.isnan(x)
+        nan += isnan.sum(axis=0)
+        posinf += (x == np.inf).sum(axis=0)
+        neginf += (x == -np.inf).sum(axis=0)
+        finite = np.isfinite(x)
+        lo = np.minimum(lo, np.where(finite, x, np.inf).min(axis=0, initial=np.inf))
+        hi = np.maximum(hi, np.where(finite, x, -np.inf).max(axis=0, initial=-np.inf))
+        for ic in range(ncols):
+            xc = x[~isnan[:, ic], ic]
+            idx = np.searchsorted(grid, xc, side="left") + np.searchsorted(grid, xc, side="right")
+            atoms[ic] += np.bincount(idx, minlength=atoms.shape[1])
+    empty = lo > hi
+    lo[empty], hi[empty] = 0, 0
+    hlo, hhi = widen_empty_range(lo, hi)
+    counts = np.zeros((ncols, nbins), dtype=np.int64)
+    for start in range(0, len(data), chunk_rows):
+        with np.errstate(invalid="ignore"):
+            counts += histogram_columns(np.asarray(data[start:start + chunk_rows], dtype=np.float64), hlo, hhi, nbins)
+    stat = os.stat(path)
+    write_json_atomic(os.path.join(folder, "summary.json"), {
+        "data": {"rows": int(len(data)), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        "dtype": str(data.dtype),
+        "edges": [float(e) for e in grid],
+        "columns": [{
+            "name": columns[ic] if ic < len(columns) else str(ic),
+            "nan": int(nan[ic]), "posinf": int(posinf[ic]), "neginf": int(neginf[ic]),
+            "min": None if empty[ic] else float(lo[ic]), "max": None if empty[ic] else float(hi[ic]),
+            "atoms": atoms[ic].tolist(),
+            "hist_range": [float(hlo[ic]), float(hhi[ic])], "hist": counts[ic].tolist(),
+        } for ic in range(ncols)],
+    })
+
+def render_feature_plots(job):
+    """Write the three figures of one feature from precomputed histograms."""
+    outfolder, c, is_conditioning, edges, orig_counts, phys_counts, tr_edges, tr_counts = job
+    #change color for cond variables
+    if is_conditioning:
+        color="red"
+        plt.hist(edges[:-1],bins=edges,weights=orig_counts,color=color,alpha=0.5)
+        suff = "_original.png"
+    else:
+        color="blue"
+        # use same binning
+        plt.hist(edges[:-1],bins=edges,weights=orig_counts,color="blue",alpha=0.5)
+        plt.hist(edges[:-1],bins=edges,weights=phys_counts,color="red",alpha=0.5)
+        suff = "_identity_check.png"
+    plt.savefig(outfolder + c + suff)
+    plt.close()
+
+    plt.hist(tr_edges[:-1],bins=tr_edges,weights=tr_counts,color=color)
+    plt.savefig(outfolder+c+".png")
+    plt.close()
+    #log y scale version
+    plt.hist(tr_edges[:-1],bins=tr_edges,weights=tr_counts,color=color)
+    plt.yscale("log")
+    plt.savefig(outfolder+c+"_log.png")
+    plt.close()
+
+def prepare_training(config, folder, inputfiles, name,skip_extraction=False, skip_plots=False, debug=False,
+                     batch_size=100000, threads=0, workers=1, shuffle_seed=None, shuffle_chunk_rows=1000000,
+                     shard_rows=0, incremental=False, plot_rows=0, plot_workers=0,
+                     plot_batch_rows=1000000, debug_options=None, profile_modules=False, io_options=None):
+    global _extraction_job
+    # per-stage profile, written to folder/profile.json
+    profile = StageProfile()
     # check if the folder exists
     # create the folder
     if not skip_extraction:
       if not os.path.exists(folder):
         os.makedirs(folder)
-      else:
+      elif not incremental:
         # delete npys
         files = [f for f in os.listdir(folder)]
         for f in files:
-            if f.endswith(".npy"):
+            if f.endswith(".npy") or f.endswith("_index.json") or f == "extracted_inputs.json":
                 os.remove(os.path.join(folder, f))
+            elif f.endswith("_shards") or f == "event_counts.d":
+                shutil.rmtree(os.path.join(folder, f))
+      if os.path.exists(os.path.join(folder, "parts")):
+          shutil.rmtree(os.path.join(folder, "parts"))
 
-      sequence = [
-        FlashSimTrainingDatasetModule(name, config, folder),
-        
-      ]
-      if config["type"] == "vector":
-        sequence.append(FlashSimEfficiencyDatasetModule(name, config, folder))
-      j=0
-      
-      for inputfile in inputfiles:
-        inputfile = ROOT.TFile.Open(inputfile)
-        inputtree = inputfile.Get("Events")
-        events = FlashSimEvent()
-        totevents=inputtree.GetEntries()
-
-
-        # --- save number of Events entries ---
-        event_count_file = os.path.join(folder, "event_counts.json")
-
-        # load existing counts if the file already exists
-        if os.path.exists(event_count_file):
-            with open(event_count_file, "r") as f:
-                event_counts = json.load(f)
-        else:
-            event_counts = {}
-
-        # use the ROOT filename as key
-        event_counts[os.path.basename(inputfile.GetName())] = int(totevents)
-
-        with open(event_count_file, "w") as f:
-            json.dump(event_counts, f, indent=2)
-        # ------------------------------------
-
-        batches = int(totevents / 100000)+1
-#       batches=1
-        pbar = tqdm.tqdm(range(batches))
-        for batch in pbar:
-            logger.debug("batch %s" % batch)
-            # create rdf
-            events.new_batch(
-                ROOT.RDataFrame(inputtree).Range(batch * 100000, (batch + 1) * 100000)
-            )
-            for o in sequence:
-                logger.debug(o)
-                events = o.run(events)
+      todo = list(range(len(inputfiles)))
+      if incremental:
+          merge_event_records(folder)
+          fingerprints = [input_fingerprint(f) for f in inputfiles]
+          todo = pending_inputs(folder, inputfiles, fingerprints)
+          logger.info("%d of %d input files already extracted", len(inputfiles) - len(todo), len(inputfiles))
+
+      # every input file is extracted to its own parts/<i>/ folder, possibly
+      # in parallel, then the parts are concatenated
+      _extraction_job = (config, name, folder, inputfiles, debug, batch_size, debug_options, profile_modules,
+                         io_options)
+      with profile.stage("extraction") as rec:
+          if workers > 1 and len(todo) > 1:
+              # fork: the config and the modules are not guaranteed to pickle.
+              # A forked child keeps the parent's interpreter and dictionaries,
+              # which is safe as long as no ROOT thread pool is running (threads
+              # do not survive a fork): implicit MT is only enabled in the workers
+              if ROOT.IsImplicitMTEnabled():
+                  ROOT.DisableImplicitMT()
+              # the cores are split among the workers, as with coverage.py --threads
+              worker_threads = threads if threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+              ctx = multiprocessing.get_context("fork")
+              with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                       initializer=init_extraction_worker,
+                                       initargs=(batch_size, worker_threads, io_options)) as pool:
+                  results = list(pool.map(run_extraction_job, todo))
+          else:
+              if todo:
+                  init_extraction_worker(batch_size, threads, io_options)
+              results = [run_extraction_job(ifile) for ifile in todo]
+          rec["files"] = len(results)
+          rec["events"] = sum(r["events"] for r in results)
+          rec["rdf_loops"] = sum(r["rdf_loops"] for r in results)
+          # the workers' writes are not in this process' I/O counters
+          rec["files_bytes_written"] = sum(r["bytes_written"] for r in results)
+          rec["bytes_read"] = sum(r["bytes_read"] for r in results)
+          rec["staged"] = {r["file"]: r["staged"] for r in results if r["staged"]["staged"]}
+          rec["module_seconds"] = {}
+          for r in results:
+              for m, t in r["module_seconds"].items():
+                  rec["module_seconds"][m] = rec["module_seconds"].get(m, 0.0) + t
+      _extraction_job = None
+      for line in rootio.describe(io_options):
+          logger.info("I/O %s", line)
+      if "out_types" not in config:
+          if results and results[0]["out_types"] is not None:
+              config["out_types"] = results[0]["out_types"]
+          else:
+              set_out_types(config, inputfiles[0])
+
+      changed = set()
+      for out in ["data.npy", "data_eff.npy"]:
+          parts = [os.path.join(folder, "parts", str(i), out) for i in todo]
+          path = os.path.join(folder, out)
+          if not any(os.path.exists(p) for p in parts):
+              continue
+          changed.add(out[:-len(".npy")])
+          if incremental and os.path.exists(path):
+              # the new rows are shuffled together with the existing ones, so
+              # that data.npy stays a uniform shuffle of all the inputs
+              with profile.stage("shuffle"):
+                  shuffle_npy([path] + parts, path, shuffle_seed, shuffle_chunk_rows)
+          else:
+              if len(todo)>1:
+                  logger.debug("Shuffling data")
+                  # the parts are scattered straight into the shuffle buckets,
+                  # so the data is written out once
+                  with profile.stage("shuffle"):
+                      shuffle_npy(parts, path, shuffle_seed, shuffle_chunk_rows)
+              else:
+                  with profile.stage("merge"):
+                      merge_npy(parts, path)
+      shutil.rmtree(os.path.join(folder, "parts"), ignore_errors=True)
 
-            if "out_types" not in config:
-                config["out_types"] = {}
-                for c in config["target_features"]:
-                    config["out_types"][c] = events.rdf.GetColumnType(c)
-            if debug:
-                logger.debug("saving debug data")
-                if isinstance(config["matching"]["target_mask"],str):
-                    events.rdf.Snapshot("Events", os.path.join(folder, f"debug_data_{j}.root"),
-                                    config["target_features"]+config["conditioning_features"]+[config["matching"]["target_mask"],config["matching"]["conditioning_index"]]
-                                    +["M"+x for x in config["target_features"]+config["conditioning_features"]]
-                                    )
-                else:
-                    events.rdf.Snapshot("Events", os.path.join(folder, f"debug_data_{j}.root"),
-                                    config["target_features"]+config["conditioning_features"]+
-                                    config["matching"]["target_mask"]+config["matching"]["conditioning_index"]+
-                                    ["M"+x for x in config["target_features"]+config["conditioning_features"]]
-                                    )
-
-            j+=1
-            
-    # read numpy from folder
-      for m in sequence:
-        m.out.close()
-      if len(inputfiles)>1:
-          logger.debug("Shuffling data")
-          data =np.load(folder + "/data.npy")
-          #shuffle data and save it back
-          np.random.shuffle(data)
-          np.save(folder + "/data.npy",data)
-          #now for data_eff if it exists
-          if "data_eff.npy" in os.listdir(folder):
-              data_eff =np.load(folder + "/data_eff.npy")
-              np.random.shuffle(data_eff)
-              np.save(folder + "/data_eff.npy",data_eff)
+      # --- save number of Events entries ---
+      # one record per input file, committed once its rows are in data.npy,
+      # then folded into event_counts.json / extracted_inputs.json
+      for r in results:
+          write_event_record(folder, r)
+      merge_event_records(folder)
+      # ------------------------------------
         
     else:
-        rdf=ROOT.RDataFrame("Events",inputfiles[0])
-        config["out_types"] = {}
-        for c in config["target_features"]:
-            config["out_types"][c] = rdf.GetColumnType(c)
+        set_out_types(config, inputfiles[0])
 
     if "matching" in config and config["matching"] is not None and (  isinstance(config["matching"]["target_mask"], list) or 
     isinstance(config["matching"]["target_index"], list)     ):
         config["conditioning_features"] = [""]+config["conditioning_features"] 
+
+    # shards are rewritten whenever their .npy changed, also when an
+    # --incremental run without --shard_rows finds an existing index
+    if not skip_extraction:
+      with profile.stage("shards"):
+        # data.npy is kept: save_processors and the plots below read it whole
+        for stem in ["data", "data_eff"]:
+            existing = index_shard_rows(folder, stem)
+            rows_per_shard = shard_rows if shard_rows > 0 else existing
+            if rows_per_shard <= 0 or not os.path.exists(os.path.join(folder, stem + ".npy")):
+                continue
+            if stem in changed or not existing:
+                columns = config["conditioning_features"]+config["target_features"] if stem == "data" else None
+                write_shards(folder, stem, rows_per_shard, columns)
    
-    training_phy2nn, validation_nn2phy, inference_phy2nn, inference_nn2phy = save_processors(config, folder)
+    with profile.stage("save_processors"):
+        training_phy2nn, validation_nn2phy, inference_phy2nn, inference_nn2phy = save_processors(config, folder)
     #    logger.debug(config)
  
     pickle.dump(config, open(os.path.join(folder, "config.pkl"), "wb"))
     yaml.dump(config, open(os.path.join(folder, "config.yaml"), "w"))
+    # range counts for info_v1.py without reading data.npy again
+    if not skip_extraction and os.path.exists(os.path.join(folder, "data.npy")):
+        with profile.stage("summary"):
+            write_summary(folder, config["conditioning_features"]+config["target_features"])
 
     if not skip_plots:
-      outfolder=folder+"/transformed_figures/"
-      if not os.path.exists(outfolder):
-        os.makedirs(outfolder)
-      orig_phys=torch.tensor(np.load(folder + "/data.npy"))
-      transformed=training_phy2nn(orig_phys) # [:,len(config["conditioning_features"]):].detach().numpy()
-      phys=inference_nn2phy(torch.cat(
-        (
-        transformed[:,len(config["conditioning_features"]):],
-        orig_phys[:,:len(config["conditioning_features"])],
-        ) , 
-      dim=1))
-      # print transformed and orig wher phys is nan or inf
-      #logger.debug("nan or inf")
-      #logger.debug("tr nan/inf",transformed[torch.isnan(phys).detach().numpy() | torch.isinf(phys).detach().numpy()])
-      #logger.debug("or nan/inf",orig_phys[torch.isnan(phys).detach().numpy() | torch.isinf(phys).detach().numpy()])
-      # #logger.debug("tr nan",transformed[torch.isnan(phys).detach().numpy()])
-      #logger.debug("or nan",orig_phys[torch.isnan(phys).detach().numpy()])
-      phys=phys.detach().numpy()
-      transformed=transformed.detach().numpy()
-      orig_phys=orig_phys.detach().numpy()
-      if len(phys) > 10 :
-        logger.debug("Making plots")
-      
-        for ic,c in enumerate(config["conditioning_features"]+config["target_features"]):
-        #  logger.debug(c)
-        #  logger.debug("nan or inf for column",c )
-        #  logger.debug("%s %s %s","tr nan/inf",transformed[np.isnan(phys[:,ic-len(config["conditioning_features"])]) | np.isinf(phys[:,ic-len(config["conditioning_features"])]),ic])
-        #  logger.debug("%s %s %s","or nan/inf",orig_phys[np.isnan(phys[:,ic-len(config["conditioning_features"])]) | np.isinf(phys[:,ic-len(config["conditioning_features"])]),ic])
-        #logger.debug("tr nan/inf",transformed[torch.isnan(phys).detach().numpy() | torch.isinf(phys).detach().numpy()])
-        # logger.debug("or nan/inf",orig_phys[torch.isnan(phys).detach().numpy() | torch.isinf(phys).detach().numpy()])
-          if np.isnan(phys[:,ic-len(config["conditioning_features"])]).any() or np.isinf(phys[:,ic-len(config["conditioning_features"])]).any():
-              logger.debug("nan or inf for column %s",c )
-              logger.debug("tr nan/inf %s",transformed[np.isnan(phys[:,ic-len(config["conditioning_features"])]) | np.isinf(phys[:,ic-len(config["conditioning_features"])]),ic])
-              logger.debug("%s %s","or nan/inf",orig_phys[np.isnan(phys[:,ic-len(config["conditioning_features"])]) | np.isinf(phys[:,ic-len(config["conditioning_features"])]),ic])
-              logger.warning("Removing nan or inf values from the plot")
-          phys[np.isnan(phys)] = 0
-          phys[np.isinf(phys)] = 0
-          transformed[np.isnan(transformed)] = 0
-          transformed[np.isinf(transformed)] = 0
-          orig_phys[np.isnan(orig_phys)] = 0
-          orig_phys[np.isinf(orig_phys)] = 0
+      with profile.stage("plots") as rec:
+        outfolder=folder+"/transformed_figures/"
+        if not os.path.exists(outfolder):
+          os.makedirs(outfolder)
+        data = np.load(folder + "/data.npy", mmap_mode="r")
+        rows = None
+        if plot_rows > 0 and len(data) > plot_rows:
+          # the plots only need the shape of the distributions
+          rows = np.sort(np.random.default_rng(shuffle_seed).choice(len(data), plot_rows, replace=False))
+          data = data[rows]
+        if len(data) > 10 :
+          rec["rows"] = int(len(data))
+          logger.debug("Making plots")
+          ncond = len(config["conditioning_features"])
+          ntarget = len(config["target_features"])
+          ncols = ncond + ntarget
 
-          
-              # phys[torch.isnan(phys[:,ic-len(config["conditioning_features"])])] = 0
-              # phys[torch.isinf(phys[:,ic-len(config["conditioning_features"])])] = 0
-              # transformed[torch.isnan(phys[:,ic-len(config["conditioning_features"])])] = 0
-              # transformed[torch.isinf(phys[:,ic-len(config["conditioning_features"])])] = 0
-              # orig_phys[torch.isnan(phys[:,ic-len(config["conditioning_features"])])] = 0
-              # orig_phys[torch.isinf(phys[:,ic-len(config["conditioning_features"])])] = 0
-          #change color for cond variables
-          bins=np.histogram_bin_edges(orig_phys[:,ic],bins=100)
-          if c in config["conditioning_features"]:
-              color="red"
-              plt.hist(orig_phys[:,ic],bins=bins,color=color,alpha=0.5)
-              suff = "_original.png"
+          # the identity check streams over row batches, so that at most one
+          # batch of orig_phys/transformed/phys is in memory at a time.
+          # First pass: histogram ranges (non-finite values are zeroed, as they
+          # are in the plots)
+          lo, hi = np.full(ncols, np.inf), np.full(ncols, -np.inf)
+          tr_lo, tr_hi = np.full(ncols, np.inf), np.full(ncols, -np.inf)
+          for start in range(0, len(data), plot_batch_rows):
+              orig_phys, transformed, _phys = transform_batch(
+                  data[start:start + plot_batch_rows], training_phy2nn, inference_nn2phy, ncond, with_phys=False)
+              for a in (transformed, orig_phys):
+                  np.nan_to_num(a, copy=False, nan=0, posinf=0, neginf=0)
+              lo, hi = np.minimum(lo, orig_phys.min(axis=0)), np.maximum(hi, orig_phys.max(axis=0))
+              tr_lo, tr_hi = np.minimum(tr_lo, transformed.min(axis=0)), np.maximum(tr_hi, transformed.max(axis=0))
+          lo, hi = widen_empty_range(lo, hi)
+          tr_lo, tr_hi = widen_empty_range(tr_lo, tr_hi)
+
+          # Second pass: histograms and non-finite counts, accumulated per batch
+          orig_counts = np.zeros((ncols, 100), dtype=np.int64)
+          phys_counts = np.zeros((ntarget, 100), dtype=np.int64)
+          tr_counts = np.zeros((ncols, 100), dtype=np.int64)
+          columns = config["conditioning_features"]+config["target_features"]
+          nonfinite = {}
+          for start in range(0, len(data), plot_batch_rows):
+              orig_phys, transformed, phys = transform_batch(
+                  data[start:start + plot_batch_rows], training_phy2nn, inference_nn2phy, ncond)
+              phys = phys[:, :ntarget]
+              row_ids = rows[start:start + len(orig_phys)] if rows is not None else np.arange(start, start + len(orig_phys))
+              # one vectorized scan per batch: count, sample and zero the non-finite values
+              sanitize_nonfinite(nonfinite, {"orig": (orig_phys, columns), "transformed": (transformed, columns),
+                                             "phys": (phys, config["target_features"])}, row_ids)
+              orig_counts += histogram_columns(orig_phys, lo, hi)
+              phys_counts += histogram_columns(phys, lo[ncond:], hi[ncond:])
+              tr_counts += histogram_columns(transformed, tr_lo, tr_hi)
+          for c in config["target_features"]:
+              if "phys" in nonfinite.get(c, {}):
+                  logger.debug("nan or inf for column %s: %s",c, nonfinite[c])
+                  logger.warning("Removing nan or inf values of %s from the plot", c)
+          write_json_atomic(os.path.join(folder, "nonfinite_report.json"),
+                            {"rows": int(len(data)), "columns": nonfinite})
+          del data
+
+          # figures rendered in parallel from the accumulated histograms
+          jobs = []
+          for ic,c in enumerate(config["conditioning_features"]+config["target_features"]):
+              jobs.append((
+                  outfolder, c, c in config["conditioning_features"],
+                  np.linspace(lo[ic], hi[ic], 101), orig_counts[ic],
+                  phys_counts[ic-ncond] if ic >= ncond else None,
+                  np.linspace(tr_lo[ic], tr_hi[ic], 101), tr_counts[ic],
+              ))
+          if plot_workers != 1 and len(jobs) > 1:
+              ctx = multiprocessing.get_context("fork")
+              with ProcessPoolExecutor(max_workers=plot_workers or None, mp_context=ctx) as pool:
+                  list(pool.map(render_feature_plots, jobs))
           else:
-              color="blue"
-              # use same binning
-              plt.hist(orig_phys[:,ic],bins=bins,color="blue",alpha=0.5)
-              plt.hist(phys[:,ic-len(config["conditioning_features"])],bins=bins,color="red",alpha=0.5)
-              suff = "_identity_check.png"
-          plt.savefig(outfolder + c + suff)
-          plt.close()
-              
-          plt.hist(transformed[:,ic],bins=100,color=color)
-          plt.savefig(outfolder+c+".png")
-          plt.close()
-          #log y scale version
-          plt.hist(transformed[:,ic],bins=100,color=color)
-          plt.yscale("log")
-          plt.savefig(outfolder+c+"_log.png")
-          plt.close()
-          #draw on same plot orig and phys
-      else:
-        logger.debug("Not enough data to make plots")    
+              for job in jobs:
+                  render_feature_plots(job)
+        else:
+          logger.debug("Not enough data to make plots")    
+
+    profile.write(os.path.join(folder, "profile.json"), io=io_options)
           
 
 
@@ -246,6 +897,74 @@ if __name__ == "__main__":
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "--batch_size", type=int,
+        help="events per RDataFrame batch; 0 processes each input file in a single multithreaded pass",
+        default=100000, required=False
+    )
+    parser.add_argument(
+        "--threads", type=int, help="ROOT implicit-MT threads (per worker) when --batch_size is 0 (0: all cores, split among the workers)",
+        default=0, required=False
+    )
+    parser.add_argument(
+        "--workers", type=int, help="number of input files extracted in parallel worker processes",
+        default=1, required=False
+    )
+    parser.add_argument(
+        "--shuffle_seed", type=int, help="seed of the shuffle of data.npy (default: random)",
+        default=None, required=False
+    )
+    parser.add_argument(
+        "--shuffle_chunk_rows", type=int, help="rows held in memory at once while shuffling (more above 256 x this many rows)",
+        default=1000000, required=False
+    )
+    parser.add_argument(
+        "--shard_rows", type=int, help="also write data.npy as shards of this many rows with a JSON index (0: off)",
+        default=0, required=False
+    )
+    parser.add_argument(
+        "--incremental",
+        action=argparse.BooleanOptionalAction,
+        help="only extract input files not yet in the folder and append them",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--plot_rows", type=int, help="random subsample of rows used for the plots (0: all rows)",
+        default=0, required=False
+    )
+    parser.add_argument(
+        "--plot_workers", type=int, help="processes rendering the figures (0: one per core)",
+        default=0, required=False
+    )
+    parser.add_argument(
+        "--plot_batch_rows", type=int, help="rows transformed at once by the identity check",
+        default=1000000, required=False
+    )
+    parser.add_argument(
+        "--debug_compression", type=str, choices=["zlib", "lzma", "lz4", "zstd"],
+        help="compression algorithm of the debug ROOT files", default="zlib", required=False
+    )
+    parser.add_argument(
+        "--debug_compression_level", type=int, help="compression level of the debug ROOT files",
+        default=1, required=False
+    )
+    parser.add_argument(
+        "--debug_every", type=int, help="only keep one event in N in the debug ROOT files",
+        default=1, required=False
+    )
+    parser.add_argument(
+        "--debug_columns", type=str, nargs="+", help="only keep these columns in the debug ROOT files",
+        default=None, required=False
+    )
+    parser.add_argument(
+        "--profile_modules",
+        action=argparse.BooleanOptionalAction,
+        help="profile every module run with cProfile, dumped to <folder>/profile/*.prof",
+        required=False,
+        default=False,
+    )
+    rootio.add_io_arguments(parser)
     parser.add_argument(
         "--loglevel", type=str, help="logging level", default="INFO", required=False
     )
@@ -274,4 +993,11 @@ if __name__ == "__main__":
     # import config from py file
     #   logger.debug(f"#{args.config}#")
     c = eval(args.config)
-    prepare_training(c, args.folder, args.inputfiles, args.config,args.skip_extraction,args.skip_plots, args.debug)
+    prepare_training(c, args.folder, args.inputfiles, args.config,args.skip_extraction,args.skip_plots, args.debug,
+                      args.batch_size, args.threads, args.workers,
+                      args.shuffle_seed, args.shuffle_chunk_rows, args.shard_rows,
+                      args.incremental, args.plot_rows, args.plot_workers,
+                      args.plot_batch_rows,
+                      {"algorithm": args.debug_compression, "level": args.debug_compression_level,
+                       "every": args.debug_every, "columns": args.debug_columns},
+                      args.profile_modules, rootio.io_options(args))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Read-ahead and staging of ROOT inputs read over /eos or xrootd.
+
+Shared by coverage.py and prepare_training.py: TTreeCache size, asynchronous
+cluster prefetching, branch pruning and an optional local staging copy,
+with the command-line options that control them.
+"""
+import os
+import tempfile
+import time
+import argparse
+import ROOT
+
+def add_io_arguments(parser):
+    """Add the I/O options to an argparse parser."""
+    parser.add_argument(
+        "--tree_cache_mb", type=int, help="TTreeCache size per tree in MB (0: ROOT default)",
+        default=0, required=False,
+    )
+    parser.add_argument(
+        "--prefetch",
+        action=argparse.BooleanOptionalAction,
+        help="prefetch the next clusters asynchronously while the current one is processed",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "--prefetch_dir", type=str, help="local disk cache of the asynchronous prefetching (default: memory only)",
+        default=None, required=False,
+    )
+    parser.add_argument(
+        "--prune_branches",
+        action=argparse.BooleanOptionalAction,
+        help="only cache (and stage) the branches that are actually read",
+        required=False,
+        default=True,
+    )
+    parser.add_argument(
+        "--stage_dir", type=str, help="copy remote inputs to this local directory before reading them",
+        default=None, required=False,
+    )
+    parser.add_argument(
+        "--keep_staged",
+        action=argparse.BooleanOptionalAction,
+        help="keep the staged copies instead of deleting them after use",
+        required=False,
+        default=False,
+    )
+
+def io_options(args):
+    """The I/O options of parsed arguments, as a picklable dict."""
+    return {
+        "tree_cache_mb": args.tree_cache_mb,
+        "prefetch": args.prefetch,
+        "prefetch_dir": args.prefetch_dir,
+        "prune_branches": args.prune_branches,
+        "stage_dir": args.stage_dir,
+        "keep_staged": args.keep_staged,
+    }
+
+def configure_io(options):
+    """Process-wide settings; call before any input file is opened.
+
+    Files opened afterwards (also by RDataFrame) prefetch asynchronously.
+    """
+    if not options:
+        return
+    ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1 if options["prefetch"] else 0)
+    if options["prefetch"] and options["prefetch_dir"]:
+        os.makedirs(options["prefetch_dir"], exist_ok=True)
+        ROOT.gEnv.SetValue("Cache.Directory", options["prefetch_dir"])
+
+def is_remote(filename):
+    return ("://" in filename and not filename.startswith("file://")) or filename.startswith("/eos/")
+
+# TTree::GetCacheAutoSize never makes a cache larger than this
+max_cache_bytes = (2 ** 31 - 1) // 4
+
+def cache_bytes(options):
+    """TTreeCache size the options ask for, within the limit of ROOT."""
+    return min(options["tree_cache_mb"] * 1024 ** 2, max_cache_bytes)
+
+def auto_cache_unit(tree):
+    """Cache size TTree::GetCacheAutoSize gives tree for a TTreeCache.Size of 1."""
+    autoflush = tree.GetAutoFlush()
+    if autoflush < 0:
+        # a negative fAutoFlush is a cluster size in bytes
+        return float(-autoflush)
+    if autoflush == 0:
+        # ROOT uses the median cluster size here when it can; 30 MB is its default
+        return 1.5 * 30000000
+    return 1.5 * autoflush * tree.GetZipBytes() / (tree.GetEntries() + 1)
+
+def set_rdf_cache_size(tree, options):
+    """Size the TTreeCache of the trees RDataFrame opens by itself.
+
+    Those trees take their size from the TTreeCache.Size factor, which
+    TTree::GetCacheAutoSize multiplies by a cluster-size unit: the factor is
+    the requested size over that unit of tree. ROOT_TTREECACHE_SIZE, which
+    takes precedence over gEnv, is set too.
+    """
+    if not options or options["tree_cache_mb"] <= 0:
+        return
+    unit = auto_cache_unit(tree)
+    if unit <= 0:
+        return
+    factor = f"{cache_bytes(options) / unit:g}"
+    ROOT.gEnv.SetValue("TTreeCache.Size", factor)
+    if os.environ.get("ROOT_TTREECACHE_SIZE"):
+        ROOT.gSystem.Setenv("ROOT_TTREECACHE_SIZE", factor)
+
+def tune_tree(tree, options, branches=None):
+    """TTreeCache and cluster prefetching of a tree read directly.
+
+    Without pruning every branch goes in the cache; with pruning only the
+    given branches, or those read during the learning phase if branches is None.
+    """
+    if not options:
+        return
+    if options["tree_cache_mb"] > 0:
+        tree.SetCacheSize(cache_bytes(options))
+        if not options["prune_branches"]:
+            tree.AddBranchToCache("*", True)
+        elif branches:
+            for b in branches:
+                if tree.GetBranch(b):
+                    tree.AddBranchToCache(b, True)
+            tree.StopCacheLearningPhase()
+    set_rdf_cache_size(tree, options)
+    if options["prefetch"]:
+        tree.SetClusterPrefetch(True)
+
+def stage_input(filename, options, branches=None):
+    """Local copy of a remote input in stage_dir, or filename itself.
+
+    With pruning and branches given only those branches of the Events tree
+    are copied (fast clone, the baskets are not recompressed). Returns
+    (path, stats) with the bytes and seconds of the copy.
+    """
+    stats = {"staged": False}
+    if not options or not options["stage_dir"] or not is_remote(filename):
+        return filename, stats
+    os.makedirs(options["stage_dir"], exist_ok=True)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    fd, local = tempfile.mkstemp(dir=options["stage_dir"], prefix=stem + "_", suffix=".root")
+    os.close(fd)
+    start = time.perf_counter()
+    if options["prune_branches"] and branches:
+        src = ROOT.TFile.Open(filename)
+        tree = src.Get("Events")
+        tree.SetBranchStatus("*", 0)
+        for b in branches:
+            if tree.GetBranch(b):
+                # the count branch of a vector branch is enabled with it
+                tree.SetBranchStatus(b, 1)
+        dst = ROOT.TFile.Open(local, "RECREATE")
+        tree.CloneTree(-1, "fast").Write()
+        dst.Close()
+        src.Close()
+    elif not ROOT.TFile.Cp(filename, local, False):
+        os.remove(local)
+        raise OSError(f"could not stage {filename} to {options['stage_dir']}")
+    stats = {"staged": True, "bytes": os.path.getsize(local), "seconds": time.perf_counter() - start}
+    return local, stats
+
+def release_input(path, filename, options):
+    """Delete a staged copy made by stage_input, unless keep_staged."""
+    if path != filename and not options["keep_staged"] and os.path.exists(path):
+        os.remove(path)
+
+def describe(options):
+    """One line per I/O setting, for the run summaries."""
+    if not options:
+        return ["I/O: ROOT defaults"]
+    return [
+        f"TTreeCache size: {cache_bytes(options) / 1024 ** 2:g} MB" if options["tree_cache_mb"] > 0 else "TTreeCache size: ROOT default",
+        f"asynchronous prefetching: {'on' if options['prefetch'] else 'off'}"
+        + (f" (cache in {options['prefetch_dir']})" if options["prefetch"] and options["prefetch_dir"] else ""),
+        f"branch pruning: {'on' if options['prune_branches'] else 'off'}",
+        f"local staging: {options['stage_dir']}" + (" (copies kept)" if options["keep_staged"] else "")
+        if options["stage_dir"] else "local staging: off",
+    ]